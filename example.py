@@ -1,4 +1,5 @@
 import datetime
+import os
 
 import pandas as pd
 from datetime import date
@@ -18,22 +19,83 @@ def t():
     print(pd.DataFrame({"time": [d]}).astype(int64) // 1e9)
 
 
+def cache():
+    """Write the joined CSV to the partitioned columnar cache, once"""
+    if not os.path.isdir("./local_data/prices_coordinates_data"):
+        access.write_columnar_cache()
+
+
 def plot_date():
-    data = pd.read_csv("./local_data/prices_coordinates_data.csv")
+    cache()
+    data = access.read_columnar_cache(
+        columns=["price", "date_of_transfer", "property_type", "latitude", "longitude"],
+        bounding_box=(52, 51, -0.5, 0.5),
+    )
     assess.plot_date_view(data)
 
 
-def plot_ans_graph(data, latitude, longitude, bounding_box, property_type):
-    """Provide reference data and their summary near the predicting x.
-    Provide a summary of data used in training and validation.
-    Plot the map of London house prices"""
-    ref = data.loc[
-        (data.latitude > latitude - 0.005)
-        & (data.latitude < latitude + 0.005)
-        & (data.longitude < longitude + 0.005)
-        & (data.longitude > longitude - 0.005)
+def _select(data, bounding_box, property_type):
+    """Sales of property_type inside bounding_box, from a data frame or filtered by the database"""
+    north, south, west, east = bounding_box
+    if not isinstance(data, pd.DataFrame):
+        return access.select_prices(
+            data,
+            bounding_box,
+            property_types=[property_type],
+            source=access.prices_source(data),
+        )
+    return data.loc[
+        (data.latitude > south)
+        & (data.latitude < north)
+        & (data.longitude < east)
+        & (data.longitude > west)
         & (data.property_type == property_type)
     ]
+
+
+def price_cube() -> assess.PriceCube:
+    """Build the regional price cube from the columnar cache once, kept in ./local_data/price_cube.pkl"""
+    path = "./local_data/price_cube.pkl"
+    if os.path.isfile(path):
+        return pd.read_pickle(path)
+    cache()
+    sales = access.read_columnar_cache(
+        columns=["price", "date_of_transfer", "postcode", "property_type"]
+    )
+    cube = assess.PriceCube.build(sales, access.load_postcode_regions())
+    pd.to_pickle(cube, path)
+    return cube
+
+
+def plot_ans_graph(data, latitude, longitude, bounding_box, property_type, cube=None):
+    """Provide reference data and their summary near the predicting x.
+    Provide a summary of data used in training and validation.
+    Plot the map of London house prices.
+    data may be a data frame or a database Connection.
+    With a PriceCube, the summaries are those of the postcode sector and district of x, looked up in the cube.
+    """
+    if cube is not None:
+        regions = cube.locate(latitude, longitude)
+        for level in ["sector", "district"]:
+            print(f"Postcode {level} {regions[level]}:")
+            print(cube.summary(regions[level], level, property_type))
+    else:
+        _print_summaries(data, latitude, longitude, bounding_box, property_type)
+
+    if not isinstance(data, pd.DataFrame):
+        data = access.select_prices(
+            data, (52, 51, -0.7, 0.3), source=access.prices_source(data)
+        )
+    assess.plot_loc_view(data)
+    # assess.osm_view("London, UK", latitude=51.5, longitude=-0.2, box_height=0.1, box_width=0.1)
+
+
+def _print_summaries(data, latitude, longitude, bounding_box, property_type):
+    ref = _select(
+        data,
+        (latitude + 0.005, latitude - 0.005, longitude - 0.005, longitude + 0.005),
+        property_type,
+    )
     print("References near predict point: ")
     print(ref[["longitude", "latitude", "property_type", "date_of_transfer", "price"]])
     mean = ref["price"].mean()
@@ -41,14 +103,7 @@ def plot_ans_graph(data, latitude, longitude, bounding_box, property_type):
     print(f"Ref mean: {mean}")
     print(f"Ref stdev: {stdev}")
 
-    north, south, west, east = bounding_box
-    ans = data.loc[
-        (data.latitude > south)
-        & (data.latitude < north)
-        & (data.longitude < east)
-        & (data.longitude > west)
-        & (data.property_type == property_type)
-    ]
+    ans = _select(data, bounding_box, property_type)
 
     mean = ans["price"].mean()
     stdev = ans["price"].std()
@@ -56,9 +111,6 @@ def plot_ans_graph(data, latitude, longitude, bounding_box, property_type):
     print(f"Mean: {mean}")
     print(f"Stdev: {stdev}")
 
-    assess.plot_loc_view(data)
-    # assess.osm_view("London, UK", latitude=51.5, longitude=-0.2, box_height=0.1, box_width=0.1)
-
 
 def predict():
     """Example prediction"""
@@ -66,13 +118,54 @@ def predict():
     longitude = -0.3
     new_date = datetime.date(2024, 1, 1)
     property_type = "T"
-    dataset = pd.read_csv("./local_data/prices_coordinates_data.csv")
+    cache()
+    dataset = access.read_columnar_cache(
+        columns=["price", "date_of_transfer", "property_type", "latitude", "longitude"]
+    )
     r2, y, bounding_box = address.predict_price(
         dataset, latitude, longitude, new_date, property_type
     )
     print(f"R2: {r2}")
     print(f"Prediction: {y}")
-    plot_ans_graph(dataset, latitude, longitude, bounding_box, property_type)
+    plot_ans_graph(
+        dataset, latitude, longitude, bounding_box, property_type, price_cube()
+    )
+
+
+def predict_db():
+    """Example prediction with the learning dataset filtered by the database"""
+    latitude = 51.4
+    longitude = -0.3
+    new_date = datetime.date(2024, 1, 1)
+    property_type = "T"
+    conn = access.create_connection(**access.get_connection_params())
+    r2, y, bounding_box = address.predict_price(
+        conn, latitude, longitude, new_date, property_type
+    )
+    print(f"R2: {r2}")
+    print(f"Prediction: {y}")
+    plot_ans_graph(conn, latitude, longitude, bounding_box, property_type, price_cube())
+
+
+def backtest():
+    """Back-test the predictions on held out sales, for accuracy and throughput"""
+    cache()
+    dataset = access.read_columnar_cache(
+        columns=[
+            "price",
+            "date_of_transfer",
+            "property_type",
+            "latitude",
+            "longitude",
+            "county",
+        ]
+    )
+    sales, accuracy, performance = address.backtest(dataset, n=2000, region="county")
+    print(accuracy)
+    print(
+        f"{performance['queries_per_second']:.1f} queries/s, latency p50 {performance['p50']:.3f}s, "
+        f"p95 {performance['p95']:.3f}s, p99 {performance['p99']:.3f}s"
+    )
 
 
 if __name__ == "__main__":
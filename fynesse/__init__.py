@@ -1,2 +1,14 @@
-from . import access
-from . import assess
+import importlib
+
+# Submodules are imported on first use, so e.g. a prediction worker using only address does not load the plotting stack
+__all__ = ["access", "assess", "address", "config"]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list:
+    return sorted(list(globals()) + __all__)
@@ -1,12 +1,25 @@
+import hashlib
+import os
+import re
+import shutil
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+import numpy as np
 import pandas
 
 from .config import *
 import pymysql
 from pymysql import Connection
+from pymysql.cursors import SSCursor
 from pymysql.constants import CLIENT
 import yaml
 import pandas as pd
 
+from . import embedded
+
 
 """These are the types of import we might expect in this file
 import httplib2
@@ -22,41 +35,90 @@ outliers. Make sure you have legalities correct, both intellectual property and
 the legal side also think about the ethical issues around this data. """
 
 
-def data() -> pandas.DataFrame:
+def data(
+    bulk_load: bool = False,
+    workers: int = 4,
+    chunksize: int = None,
+    compact: bool = False,
+    incremental: bool = False,
+    update_filenames: list = None,
+    materialize: bool = False,
+) -> pandas.DataFrame:
     """Read the data from the web or local file, load to database, do joining by SQL, and return structured format
     such as a data frame.
-    Called after connected to the mariadb URL"""
-
-    # Load database configurations
-    db_config = config
-    with open("credentials.yaml") as f:
-        credentials = yaml.safe_load(f)
-        username = credentials["username"]
-        password = credentials["password"]
-    url = db_config["data_url"]
-    port = db_config["port"]
+    Called after connected to the mariadb URL
+    :param bulk_load: load all CSV files concurrently and create keys and indexes only once they are all in
+    :param workers: number of concurrent connections used when bulk_load is set
+    :param chunksize: if given, fetch the join through a server-side cursor in typed chunks of this many rows.
+        The chunks are still concatenated into one data frame; use iter_join_pp_pc or iter_query to stream
+    :param compact: return the compact schema of to_compact (categorical codes, float32 coordinates, epoch days).
+        Off by default so the returned dtypes stay those of the join
+    :param incremental: keep the existing tables and only load files whose checksum is not in `load_manifest`
+    :param update_filenames: monthly Land Registry update files applied by record_status when incremental is set
+    :param materialize: fill `prices_coordinates_data` from the join, see build_prices_coordinates_data
+    """
 
     # Create a connection
-    conn = create_connection(
-        user=username,
-        password=password,
-        host=url,
-        database="property_prices",
-        port=port,
-    )
+    conn = create_connection(**get_connection_params())
 
     # Create database `property_prices`
     create_database_property_prices(conn)
 
+    pp_filenames = [f"pp-{year}.csv" for year in range(2018, 2023)]
+    postcode_filename = "open_postcode_geo.csv"
+
+    if incremental:
+        ingest_incremental(
+            conn,
+            pp_filenames,
+            postcode_filename,
+            ["pp-monthly-update-new-version.csv"]
+            if update_filenames is None
+            else update_filenames,
+        )
+        if materialize:
+            # Finishes an interrupted build; years changed by the update were already rebuilt
+            build_prices_coordinates_data(conn)
+        return _join_to_dataframe(conn, chunksize, compact)
+
+    # A full load replaces every table, so the manifest and statistics start again from the files loaded below
+    setup_load_manifest(conn, replace=True)
+    setup_price_stats(conn, replace=True)
+    # A materialized join of the old tables would be stale, it only comes back if materialize builds it again
+    drop_prices_coordinates_data(conn)
+
+    if bulk_load:
+        # Create tables without keys, load every file in parallel, then build keys and indexes once
+        setup_pp_data(conn, defer_keys=True)
+        setup_postcode_data(conn, defer_keys=True)
+        bulk_upload_csvs(
+            [(filename, "pp_data") for filename in pp_filenames]
+            + [(postcode_filename, "postcode_data")],
+            workers=workers,
+        )
+        for filename in pp_filenames + [postcode_filename]:
+            if os.path.isfile(filename):
+                record_load(conn, filename, file_checksum(filename))
+        print("Creating keys and indexes...")
+        add_primary_key(conn, "pp_data")
+        add_primary_key(conn, "postcode_data")
+        index_postcode_data(conn)
+        index_filter_columns(conn)
+        refresh_price_stats(conn)
+        if materialize:
+            build_prices_coordinates_data(conn)
+        print("Done")
+        return _join_to_dataframe(conn, chunksize, compact)
+
     # Create table `pp_data`, specify schema and primary key
     setup_pp_data(conn)
 
     # Load csv data to table `pp_data`
-    pp_filenames = [f"pp-{year}.csv" for year in range(2018, 2023)]
     for filename in pp_filenames:
         if os.path.isfile(filename):
             print(f"Loading {filename} to pp_data...")
             upload_csv_to_table(conn, filename, "pp_data")
+            record_load(conn, filename, file_checksum(filename))
             print("Load done")
         else:
             print(f">>>File {filename} doesn't exist, skipped.")
@@ -69,14 +131,15 @@ def data() -> pandas.DataFrame:
     # >>>>> May take half an hour to run!!! <<<<<
     # res = count_number_of_rows(conn, "pp_data")
     # print_res(res)
+    # The maintained `price_stats` below answers this without a scan, once postcode_data is loaded
 
     # Create table `postcode_data`, specify schema and primary key
     setup_postcode_data(conn)
 
     # Load csv to database `postcode_data` table
-    postcode_filename = "open_postcode_geo.csv"
     print(f"Loading {postcode_filename} to postcode_data...")
     upload_csv_to_table(conn, postcode_filename, "postcode_data")
+    record_load(conn, postcode_filename, file_checksum(postcode_filename))
     print("Load done")
 
     # Look into first 5 rows
@@ -92,108 +155,615 @@ def data() -> pandas.DataFrame:
     # Index postcode_data by postcode
     index_postcode_data(conn)
 
-    # Join pp_data and postcode_data on postcode
+    # Index the columns filtered on by select_prices
+    index_filter_columns(conn)
+
+    # Record row counts and ranges per year and property_type
+    refresh_price_stats(conn)
+    stats = get_price_stats(conn)
+    print(f">>> Number of rows of `pp_data`: {count_from_stats(stats)}")
+
+    # Fill `prices_coordinates_data` with the join, year by year
+    if materialize:
+        build_prices_coordinates_data(conn)
+
+    return _join_to_dataframe(conn, chunksize, compact)
+
+
+def _join_to_dataframe(
+    conn: Connection, chunksize: int = None, compact: bool = False
+) -> pd.DataFrame:
+    """Join pp_data and postcode_data on postcode and return the result as a data frame.
+    With chunksize the fetch is chunked, which bounds the size of each cursor batch and of the intermediate
+    row tuples, but every chunk ends up in the returned frame. Iterate iter_join_pp_pc to stream instead.
+    """
+    if chunksize is not None:
+        df = concat_chunks(iter_join_pp_pc(conn, chunksize, compact))
+        print(df.iloc[range(min(5, len(df)))])
+        return df
+
     rows = join_pp_pc(conn)
-    for i in range(5):
+    for i in range(min(5, len(rows))):
         print(rows[i])
 
-    column_names = [
-        "price",
-        "date_of_transfer",
-        "postcode",
-        "property_type",
-        "new_build_flag",
-        "tenure_type",
-        "locality",
-        "town_city",
-        "district",
-        "county",
-        "country",
-        "latitude",
-        "longitude",
-    ]
-    df = pd.DataFrame(rows, columns=column_names)
+    df = pd.DataFrame(rows, columns=PCD_COLUMNS)
+    del rows
+    if compact:
+        df = to_compact(_type_pcd_chunk(df))
     return df
 
 
-def pandas_join_pp_pc() -> None:
-    """Read data from CSV, do the joining with pandas, and store the result df to CSV"""
-    pp_columns = [
-        "transaction_unique_identifier",
-        "price",
-        "date_of_transfer",
-        "postcode",
-        "property_type",
-        "new_build_flag",
-        "tenure_type",
-        "primary_addressable_object_name",
-        "secondary_addressable_object_name",
-        "street",
-        "locality",
-        "town_city",
-        "district",
-        "county",
-        "ppd_category_type",
-        "record_status",
-        "db_id",
-    ]
-    pp_data = pd.DataFrame(columns=pp_columns)
+def get_connection_params(database: str = "property_prices") -> dict:
+    """Collect the keyword arguments of create_connection from credentials.yaml and the config"""
+    backend = config.get("backend", "mariadb")
+    if backend == "embedded":
+        return dict(database=database, backend=backend)
+    with open("credentials.yaml") as f:
+        credentials = yaml.safe_load(f)
+    return dict(
+        user=credentials["username"],
+        password=credentials["password"],
+        host=config["data_url"],
+        database=database,
+        port=config["port"],
+        backend=backend,
+    )
+
+
+PP_COLUMNS = [
+    "transaction_unique_identifier",
+    "price",
+    "date_of_transfer",
+    "postcode",
+    "property_type",
+    "new_build_flag",
+    "tenure_type",
+    "primary_addressable_object_name",
+    "secondary_addressable_object_name",
+    "street",
+    "locality",
+    "town_city",
+    "district",
+    "county",
+    "ppd_category_type",
+    "record_status",
+    "db_id",
+]
+
+PC_COLUMNS = [
+    "postcode",
+    "status",
+    "usertype",
+    "easting",
+    "northing",
+    "positional_quality_indicator",
+    "country",
+    "latitude",
+    "longitude",
+    "postcode_no_space",
+    "postcode_fixed_width_seven",
+    "postcode_fixed_width_eight",
+    "postcode_area",
+    "postcode_district",
+    "postcode_sector",
+    "outcode",
+    "incode",
+    "db_id",
+]
+
+PCD_COLUMNS = [
+    "price",
+    "date_of_transfer",
+    "postcode",
+    "property_type",
+    "new_build_flag",
+    "tenure_type",
+    "locality",
+    "town_city",
+    "district",
+    "county",
+    "country",
+    "latitude",
+    "longitude",
+]
+
+
+def pandas_join_pp_pc(chunksize: int = None) -> int:
+    """Read data from CSV, do the joining with pandas, and store the result df to CSV.
+    Both modes join with load_postcode_lookup, so they write the same rows.
+    :param chunksize: if given, stream each pp-YEAR.csv in chunks of this many rows instead of loading everything
+    :return: number of rows written
+    """
+    if chunksize is not None:
+        return stream_join_pp_pc(chunksize=chunksize)
+
+    pp_frames = []
     for i in range(2018, 2023):
         print(f"Reading pp-{i}.csv")
-        df = pd.read_csv(f"pp-{i}.csv", names=pp_columns)
-        pp_data = pd.concat([pp_data, df])
+        pp_frames.append(pd.read_csv(f"pp-{i}.csv", names=PP_COLUMNS))
+    pp_data = pd.concat(pp_frames, ignore_index=True)
     print(pp_data.iloc[range(5)])
 
-    pc_columns = [
-        "postcode",
-        "status",
-        "usertype",
-        "easting",
-        "northing",
-        "positional_quality_indicator",
-        "country",
-        "latitude",
-        "longitude",
-        "postcode_no_space",
-        "postcode_fixed_width_seven",
-        "postcode_fixed_width_eight",
-        "postcode_area",
-        "postcode_district",
-        "postcode_sector",
-        "outcode",
-        "incode",
-        "db_id",
-    ]
     print("Reading open_postcode_geo.csv")
-    postcode_data = pd.read_csv("open_postcode_geo.csv", names=pc_columns)
+    postcode_data = load_postcode_lookup()
     print(postcode_data.iloc[range(5)])
 
-    pcd_columns = [
-        "price",
-        "date_of_transfer",
-        "postcode",
-        "property_type",
-        "new_build_flag",
-        "tenure_type",
-        "locality",
-        "town_city",
-        "district",
-        "county",
-        "country",
-        "latitude",
-        "longitude",
-    ]
     print("Joining...")
-    prices_coordinates_data = pd.merge(
-        pp_data, postcode_data, how="left", on="postcode"
-    )[pcd_columns]
+    prices_coordinates_data = pp_data.join(postcode_data, on="postcode", how="left")[
+        PCD_COLUMNS
+    ]
     print(prices_coordinates_data.iloc[range(5)])
 
     print("Writing to prices_coordinates_data.csv")
     prices_coordinates_data.to_csv("prices_coordinates_data.csv")
 
     print("Done")
-    return
+    return len(prices_coordinates_data.index)
+
+
+def load_postcode_lookup(filename: str = "open_postcode_geo.csv") -> pd.DataFrame:
+    """Read only the columns of the postcode CSV needed for joining, indexed by postcode"""
+    # The CSV has every column but `db_id`
+    lookup = pd.read_csv(
+        filename,
+        names=PC_COLUMNS[:-1],
+        usecols=["postcode", "country", "latitude", "longitude"],
+        dtype={"postcode": str, "country": "category"},
+    )
+    # Keep the first row per postcode so that the join never fans out
+    lookup = lookup.drop_duplicates(subset="postcode").set_index("postcode")
+    return lookup
+
+
+POSTCODE_REGION_COLUMNS = [
+    "postcode",
+    "postcode_area",
+    "postcode_district",
+    "postcode_sector",
+    "latitude",
+    "longitude",
+]
+
+
+def load_postcode_regions(source="open_postcode_geo.csv") -> pd.DataFrame:
+    """Read the area, district and sector of every postcode, with its coordinates, indexed by postcode
+    :param source: the postcode CSV, or a Connection to read `postcode_data` from
+    """
+    if isinstance(source, str):
+        # The CSV has every column but `db_id`
+        regions = pd.read_csv(
+            source,
+            names=PC_COLUMNS[:-1],
+            usecols=POSTCODE_REGION_COLUMNS,
+            dtype={
+                "postcode": str,
+                "postcode_area": str,
+                "postcode_district": str,
+                "postcode_sector": str,
+            },
+        )
+    else:
+        cur = source.cursor()
+        cur.execute(
+            f"SELECT {', '.join(POSTCODE_REGION_COLUMNS)} FROM `postcode_data`;"
+        )
+        regions = _type_pcd_chunk(
+            pd.DataFrame(cur.fetchall(), columns=POSTCODE_REGION_COLUMNS)
+        )
+    regions = regions.drop_duplicates(subset="postcode").set_index("postcode")
+    return regions[POSTCODE_REGION_COLUMNS[1:]]
+
+
+def stream_join_pp_pc(
+    chunksize: int = 1_000_000,
+    years: range = range(2018, 2023),
+    output: str = "prices_coordinates_data.csv",
+) -> int:
+    """Join pp-YEAR.csv files with the postcode data chunk by chunk, appending to the output CSV.
+    Peak memory is bounded by the postcode lookup plus one chunk, rather than by the total row count.
+    :param chunksize: number of price paid rows read and joined at a time
+    :param years: years of pp-YEAR.csv files to read
+    :param output: the CSV file to write
+    :return: number of rows written
+    """
+    print("Reading open_postcode_geo.csv")
+    lookup = load_postcode_lookup()
+
+    if os.path.exists(output):
+        os.remove(output)
+
+    written = 0
+    for year in years:
+        filename = f"pp-{year}.csv"
+        if not os.path.isfile(filename):
+            print(f">>>File {filename} doesn't exist, skipped.")
+            continue
+        print(f"Streaming {filename}...")
+        for chunk in pd.read_csv(filename, names=PP_COLUMNS, chunksize=chunksize):
+            joined = chunk.join(lookup, on="postcode", how="left")[PCD_COLUMNS]
+            joined.index = pd.RangeIndex(written, written + len(joined))
+            joined.to_csv(output, mode="a", header=written == 0)
+            written += len(joined)
+        print(f"{written} rows written")
+
+    print("Done")
+    return written
+
+
+PCD_CSV_DTYPES = {
+    "price": "int64",
+    "postcode": str,
+    "property_type": str,
+    "new_build_flag": str,
+    "tenure_type": str,
+    "locality": str,
+    "town_city": str,
+    "district": str,
+    "county": str,
+    "country": str,
+    "latitude": "float64",
+    "longitude": "float64",
+}
+
+
+def write_columnar_cache(
+    source: str = "./local_data/prices_coordinates_data.csv",
+    root: str = "./local_data/prices_coordinates_data",
+    chunksize: int = 2_000_000,
+    row_group_size: int = 50_000,
+) -> None:
+    """
+    Write the joined prices_coordinates_data CSV once to a Parquet dataset partitioned by year and property_type.
+    Rows are sorted by latitude then longitude within each chunk, so that the row-group min/max statistics
+    on latitude, longitude and date_of_transfer are narrow enough to skip most row groups on a filtered read.
+    :param source: the CSV written by pandas_join_pp_pc
+    :param root: directory of the dataset
+    :param chunksize: number of CSV rows read and written at a time
+    :param row_group_size: maximum number of rows per Parquet row group
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Part files of a previous write are named by chunk, so a rewrite with fewer chunks would leave some behind
+    shutil.rmtree(root, ignore_errors=True)
+    for i, chunk in enumerate(
+        pd.read_csv(
+            source,
+            usecols=PCD_COLUMNS,
+            dtype=PCD_CSV_DTYPES,
+            parse_dates=["date_of_transfer"],
+            chunksize=chunksize,
+        )
+    ):
+        print(f"Writing chunk {i} to {root}...")
+        chunk["year"] = chunk["date_of_transfer"].dt.year.astype("int32")
+        chunk = chunk.sort_values(["year", "property_type", "latitude", "longitude"])
+        ds.write_dataset(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            root,
+            format="parquet",
+            partitioning=["year", "property_type"],
+            partitioning_flavor="hive",
+            basename_template=f"part-{i}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            max_rows_per_group=row_group_size,
+            min_rows_per_group=min(row_group_size, chunksize),
+        )
+    print("Done")
+
+
+def read_columnar_cache(
+    root: str = "./local_data/prices_coordinates_data",
+    columns: list = None,
+    bounding_box: tuple = None,
+    date_range: tuple = None,
+    property_types: list = None,
+    compact: bool = True,
+) -> pd.DataFrame:
+    """
+    Read back only the partitions, row groups and columns of the Parquet cache that match the filters
+    :param root: directory of the dataset written by write_columnar_cache
+    :param columns: columns to read, all of PCD_COLUMNS by default
+    :param bounding_box: (north, south, west, east), as used in address
+    :param date_range: (lower, upper) bounds of date_of_transfer, inclusive
+    :param property_types: property_type codes to keep
+    :param compact: return the compact schema of to_compact
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(root, format="parquet", partitioning="hive")
+
+    conditions = []
+    if bounding_box is not None:
+        north, south, west, east = bounding_box
+        conditions += [
+            ds.field("latitude") < north,
+            ds.field("latitude") > south,
+            ds.field("longitude") < east,
+            ds.field("longitude") > west,
+        ]
+    if date_range is not None:
+        date_lb, date_ub = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+        # The year condition prunes whole partitions before any row group is opened
+        conditions += [
+            ds.field("year") >= date_lb.year,
+            ds.field("year") <= date_ub.year,
+            ds.field("date_of_transfer") >= date_lb,
+            ds.field("date_of_transfer") <= date_ub,
+        ]
+    if property_types is not None:
+        conditions.append(ds.field("property_type").isin(list(property_types)))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    table = dataset.to_table(
+        columns=PCD_COLUMNS if columns is None else columns, filter=expression
+    )
+    df = table.to_pandas()
+    if compact:
+        df = to_compact(df)
+    return df
+
+
+OSM_KEYS = ["amenity", "shop", "leisure", "tourism", "historic"]
+
+
+def write_osm_tiles(
+    extract_file: str,
+    root: str = "./local_data/osm_tiles",
+    tile_size: float = 0.1,
+    keys: list = None,
+) -> int:
+    """
+    Read the points of interest of a local OpenStreetMap extract once, and write them to a cache of square tiles,
+    so the features around a place are later read from a few tiles instead of downloaded
+    :param extract_file: OSM XML extract (.osm, or compressed .osm.bz2), as read by osmnx
+    :param root: directory of the tile cache
+    :param tile_size: tile size in degrees
+    :param keys: OSM keys of the points of interest, OSM_KEYS by default
+    :return: number of points of interest written
+    """
+    import osmnx as ox
+
+    if keys is None:
+        keys = OSM_KEYS
+    features = ox.features_from_xml(extract_file, tags={key: True for key in keys})
+    # Ways and relations are placed at a point inside their shape
+    points = features.geometry.representative_point()
+    pois = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "latitude": points.y[features[key].notna()].to_numpy(),
+                    "longitude": points.x[features[key].notna()].to_numpy(),
+                    "key": key,
+                }
+            )
+            for key in keys
+            if key in features.columns
+        ]
+        + [pd.DataFrame(columns=["latitude", "longitude", "key"])],
+        ignore_index=True,
+    )
+    rows = np.floor(pois.latitude / tile_size).astype("int64")
+    columns = np.floor(pois.longitude / tile_size).astype("int64")
+
+    os.makedirs(root, exist_ok=True)
+    for filename in os.listdir(root):
+        if filename.endswith(".parquet"):
+            os.remove(os.path.join(root, filename))
+    tiles = pois.groupby([rows, columns])
+    for (row, column), tile in tiles:
+        tile.to_parquet(os.path.join(root, f"{row}_{column}.parquet"), index=False)
+    with open(os.path.join(root, "tiles.yml"), "w") as file:
+        yaml.dump({"tile_size": tile_size, "keys": list(keys)}, file)
+    print(
+        f">>>Wrote {len(pois.index)} points of interest in {tiles.ngroups} tiles to {root}"
+    )
+    return len(pois.index)
+
+
+class OSMTiles:
+    """Points of interest from the tile cache of write_osm_tiles, keeping the most recently used tiles in memory"""
+
+    def __init__(self, root: str = "./local_data/osm_tiles", maxsize: int = 64):
+        """
+        :param root: directory of the tile cache
+        :param maxsize: number of tiles kept in memory
+        """
+        with open(os.path.join(root, "tiles.yml")) as file:
+            meta = yaml.load(file, Loader=yaml.FullLoader)
+        self.root = root
+        self.tile_size = meta["tile_size"]
+        self.keys = meta["keys"]
+        # Tiles without points of interest are not written, so only the listed ones are ever read
+        self.existing = set()
+        for filename in os.listdir(root):
+            match = re.fullmatch(r"(-?\d+)_(-?\d+)\.parquet", filename)
+            if match is not None:
+                self.existing.add((int(match.group(1)), int(match.group(2))))
+        self.maxsize = maxsize
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _tile(self, row: int, column: int) -> pd.DataFrame:
+        tile = self.tiles.get((row, column))
+        if tile is not None:
+            self.hits += 1
+            self.tiles.move_to_end((row, column))
+            return tile
+        self.misses += 1
+        tile = pd.read_parquet(os.path.join(self.root, f"{row}_{column}.parquet"))
+        self.tiles[(row, column)] = tile
+        while len(self.tiles) > self.maxsize:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def points(self, bounding_box: tuple) -> pd.DataFrame:
+        """
+        Points of interest in a bounding box, with latitude, longitude and key columns
+        :param bounding_box: (north, south, west, east)
+        """
+        north, south, west, east = bounding_box
+        rows = range(
+            int(np.floor(max(south, -90) / self.tile_size)),
+            int(np.floor(min(north, 90) / self.tile_size)) + 1,
+        )
+        columns = range(
+            int(np.floor(max(west, -180) / self.tile_size)),
+            int(np.floor(min(east, 180) / self.tile_size)) + 1,
+        )
+        # Walk whichever is smaller, the tiles of the box or the tiles written
+        if len(rows) * len(columns) > len(self.existing):
+            tiles = sorted(
+                (row, column)
+                for row, column in self.existing
+                if row in rows and column in columns
+            )
+        else:
+            tiles = [
+                (row, column)
+                for row in rows
+                for column in columns
+                if (row, column) in self.existing
+            ]
+        empty = pd.DataFrame(
+            {
+                "latitude": pd.Series(dtype="float64"),
+                "longitude": pd.Series(dtype="float64"),
+                "key": pd.Series(dtype="str"),
+            }
+        )
+        pois = pd.concat(
+            [empty] + [self._tile(row, column) for row, column in tiles],
+            ignore_index=True,
+        )
+        return pois[
+            (north > pois.latitude)
+            & (pois.latitude > south)
+            & (east > pois.longitude)
+            & (pois.longitude > west)
+        ]
+
+
+CATEGORICAL_COLUMNS = [
+    "property_type",
+    "new_build_flag",
+    "tenure_type",
+    "town_city",
+    "district",
+    "county",
+    "country",
+]
+
+EPOCH = pd.Timestamp(0)
+
+
+def epoch_day(date) -> int:
+    """Number of days from 1970-01-01 to the given date"""
+    return (pd.Timestamp(date) - EPOCH).days
+
+
+def _parse_unique(dates: pd.Series, errors: str = "raise") -> tuple:
+    """
+    Parse each distinct value of a column of date strings or date objects once.
+    :param errors: as for pd.to_datetime, "coerce" turns values that do not parse into NaT
+    :return: the codes of the values in the column, and the parsed distinct values as datetime64[ns],
+        followed by NaT, which the code -1 of missing values picks
+    """
+    codes, uniques = pd.factorize(dates)
+    # Price paid dates are "YYYY-MM-DD HH:MM" in the CSV files, and "YYYY-MM-DD" from the database
+    parsed = pd.to_datetime(
+        pd.Index(uniques), format="ISO8601", errors=errors
+    ).to_numpy("datetime64[ns]")
+    return codes, np.append(parsed, np.datetime64("NaT", "ns"))
+
+
+def parse_dates(dates: pd.Series, errors: str = "raise") -> pd.Series:
+    """
+    Convert a column of date strings, date objects, datetimes or compact epoch days to datetimes.
+    There are far fewer distinct dates than sales, so each distinct value is parsed once and the results
+    are spread back to the column through its codes.
+    :param errors: as for pd.to_datetime, "coerce" turns values that do not parse into NaT
+    """
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates
+    if pd.api.types.is_integer_dtype(dates):
+        return from_epoch_days(dates)
+    codes, parsed = _parse_unique(dates, errors)
+    return pd.Series(parsed[codes], index=dates.index, name=dates.name)
+
+
+def to_epoch_days(dates: pd.Series) -> pd.Series:
+    """Convert a column of dates or date strings to int32 days since 1970-01-01, parsing each distinct value once"""
+    if pd.api.types.is_integer_dtype(dates):
+        return dates.astype("int32")
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        days = dates.to_numpy().astype("datetime64[D]")
+    else:
+        codes, parsed = _parse_unique(dates)
+        days = parsed.astype("datetime64[D]")[codes]
+    days = days.astype("int64").astype("int32")
+    return pd.Series(days, index=dates.index, name=dates.name)
+
+
+def from_epoch_days(days: pd.Series) -> pd.Series:
+    """Convert a column of days since 1970-01-01 back to datetimes"""
+    return pd.to_datetime(days, unit="D")
+
+
+def to_compact(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the joined price data to its compact schema, in place:
+    categoricals for the low-cardinality code and place columns, uint32 price, float32 coordinates,
+    and date_of_transfer as int32 days since 1970-01-01 (see epoch_day)
+    :param df: data frame with any of the PCD_COLUMNS
+    :return: the same data frame
+    """
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    if "price" in df.columns:
+        df["price"] = df["price"].astype("uint32")
+    for column in ["latitude", "longitude"]:
+        if column in df.columns:
+            df[column] = df[column].astype("float32")
+    if "date_of_transfer" in df.columns and not pd.api.types.is_integer_dtype(
+        df["date_of_transfer"]
+    ):
+        df["date_of_transfer"] = to_epoch_days(df["date_of_transfer"])
+    return df
+
+
+def concat_chunks(chunks) -> pd.DataFrame:
+    """Concatenate data frame chunks, unifying categories so that categorical columns stay categorical"""
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame(columns=PCD_COLUMNS)
+    for column in chunks[0].select_dtypes("category").columns:
+        categories = sorted(
+            set().union(*(chunk[column].cat.categories for chunk in chunks))
+        )
+        for chunk in chunks:
+            chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Report the dtype and resident memory of every column of a data frame, with the total in the last row"""
+    usage = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame(
+        {
+            "dtype": df.dtypes.astype(str),
+            "bytes": usage,
+            "bytes_per_row": usage / max(len(df), 1),
+        }
+    )
+    report.loc["total"] = ["", usage.sum(), usage.sum() / max(len(df), 1)]
+    return report
 
 
 def print_res(rows: tuple) -> None:
@@ -202,7 +772,14 @@ def print_res(rows: tuple) -> None:
         print(r)
 
 
-def create_connection(user, password, host, database, port=3306) -> Connection:
+def create_connection(
+    user=None,
+    password=None,
+    host=None,
+    database="property_prices",
+    port=3306,
+    backend=None,
+) -> Connection:
     """Create a database connection to the MariaDB database
         specified by the host url and database name.
     :param user: username
@@ -210,22 +787,31 @@ def create_connection(user, password, host, database, port=3306) -> Connection:
     :param host: host url
     :param database: database
     :param port: port number
+    :param backend: "mariadb", or "embedded" for the in-process database of fynesse.embedded stored in a local
+        file named after the database; the "backend" config entry by default
     :return: Connection object or None
     """
+    if backend is None:
+        backend = config.get("backend", "mariadb")
     conn = None
     try:
-        conn = pymysql.connect(
-            user=user,
-            passwd=password,
-            host=host,
-            port=port,
-            local_infile=1,
-            db=database,
-            # client_flag=CLIENT.MULTI_STATEMENTS,
-            autocommit=True,
-        )
+        if backend == "embedded":
+            conn = embedded.connect(database)
+        elif backend == "mariadb":
+            conn = pymysql.connect(
+                user=user,
+                passwd=password,
+                host=host,
+                port=port,
+                local_infile=1,
+                db=database,
+                # client_flag=CLIENT.MULTI_STATEMENTS,
+                autocommit=True,
+            )
+        else:
+            raise ValueError(f"Unknown backend {backend}.")
     except Exception as e:
-        print(f"Error connecting to the MariaDB Server: {e}")
+        print(f"Error connecting to the {backend} database: {e}")
     return conn
 
 
@@ -243,8 +829,11 @@ def create_database_property_prices(conn: Connection) -> tuple:
     return rows
 
 
-def setup_pp_data(conn: Connection) -> tuple:
-    """Create `pp_data` table, specify schema and primary key"""
+def setup_pp_data(conn: Connection, defer_keys: bool = False) -> tuple:
+    """Create `pp_data` table, specify schema and primary key
+    :param conn: the Connection object
+    :param defer_keys: leave out the `db_id` primary key, to be added by add_primary_key after bulk loading
+    """
     cur = conn.cursor()
     cur.execute(
         """
@@ -277,6 +866,12 @@ def setup_pp_data(conn: Connection) -> tuple:
         ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin AUTO_INCREMENT=1 ;
     """
     )
+    if defer_keys:
+        # `db_id` is added back, numbering the loaded rows, by add_primary_key
+        cur.execute("ALTER TABLE `pp_data` DROP COLUMN `db_id`;")
+        rows = cur.fetchall()
+        return rows
+
     cur.execute(
         """
         --
@@ -297,8 +892,11 @@ def setup_pp_data(conn: Connection) -> tuple:
     return rows
 
 
-def setup_postcode_data(conn: Connection) -> tuple:
-    """Create `postcode_data` table, specify schema and primary key"""
+def setup_postcode_data(conn: Connection, defer_keys: bool = False) -> tuple:
+    """Create `postcode_data` table, specify schema and primary key
+    :param conn: the Connection object
+    :param defer_keys: leave out the `db_id` primary key, to be added by add_primary_key after bulk loading
+    """
     cur = conn.cursor()
     cur.execute(
         """
@@ -332,6 +930,12 @@ def setup_postcode_data(conn: Connection) -> tuple:
         ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin;
     """
     )
+    if defer_keys:
+        # `db_id` is added back, numbering the loaded rows, by add_primary_key
+        cur.execute("ALTER TABLE `postcode_data` DROP COLUMN `db_id`;")
+        rows = cur.fetchall()
+        return rows
+
     cur.execute(
         """
         --
@@ -352,8 +956,13 @@ def setup_postcode_data(conn: Connection) -> tuple:
     return rows
 
 
-def setup_prices_coordinates_data(conn: Connection) -> tuple:
-    """Create `prices_coordinates_data` table, specify schema and primary key"""
+def setup_prices_coordinates_data(conn: Connection, replace: bool = True) -> tuple:
+    """Create `prices_coordinates_data` table, specify schema and primary key
+    :param conn: the Connection object
+    :param replace: drop the existing table first, otherwise keep it if it exists
+    """
+    if not replace and table_exists(conn, "prices_coordinates_data"):
+        return ()
     cur = conn.cursor()
     cur.execute(
         """
@@ -446,6 +1055,602 @@ def upload_csv_to_table(
     return rows
 
 
+def add_primary_key(conn: Connection, table: str) -> tuple:
+    """Add the auto-increment `db_id` primary key to a table created with defer_keys, numbering the loaded rows
+    :param conn: the Connection object
+    :param table: the table to add the key to
+    """
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        ALTER TABLE `{table}`
+        ADD COLUMN `db_id` bigint(20) unsigned NOT NULL AUTO_INCREMENT PRIMARY KEY;
+    """
+    )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def _timed_upload(params: dict, filename: str, table_name: str) -> dict:
+    """Upload one csv file over its own connection and measure the throughput"""
+    conn = create_connection(**params)
+    start = time.perf_counter()
+    upload_csv_to_table(conn, filename, table_name)
+    seconds = time.perf_counter() - start
+    loaded = conn.affected_rows()
+    conn.close()
+    return {
+        "filename": filename,
+        "table": table_name,
+        "rows": loaded,
+        "seconds": seconds,
+        "rows_per_second": loaded / seconds if seconds > 0 else float("nan"),
+        "mb_per_second": os.path.getsize(filename) / 1e6 / seconds
+        if seconds > 0
+        else float("nan"),
+    }
+
+
+def bulk_upload_csvs(files: list, workers: int = 4, params: dict = None) -> list:
+    """
+    Upload several csv files concurrently, each over its own connection
+    :param files: list of (filename, table_name) pairs
+    :param workers: number of concurrent connections
+    :param params: keyword arguments of create_connection, read from credentials.yaml by default
+    :return: list of per-file throughput reports
+    """
+    if params is None:
+        params = get_connection_params()
+
+    existing = []
+    for filename, table_name in files:
+        if os.path.isfile(filename):
+            existing.append((filename, table_name))
+        else:
+            print(f">>>File {filename} doesn't exist, skipped.")
+
+    print(f"Loading {len(existing)} files with {workers} workers...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_timed_upload, params, filename, table_name)
+            for filename, table_name in existing
+        ]
+        reports = []
+        for future in futures:
+            report = future.result()
+            print(
+                f"{report['filename']} -> {report['table']}: {report['rows']} rows in {report['seconds']:.1f}s "
+                f"({report['rows_per_second']:.0f} rows/s, {report['mb_per_second']:.1f} MB/s)"
+            )
+            reports.append(report)
+    print(f"Load done in {time.perf_counter() - start:.1f}s")
+    return reports
+
+
+def table_exists(conn: Connection, table: str) -> bool:
+    """Check whether a table exists in the current database"""
+    cur = conn.cursor()
+    cur.execute("SHOW TABLES LIKE %s;", (table,))
+    return cur.fetchone() is not None
+
+
+def file_checksum(filename: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 hex digest of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def setup_load_manifest(conn: Connection, replace: bool = False) -> tuple:
+    """Create `load_manifest` table recording every loaded file and its checksum
+    :param conn: the Connection object
+    :param replace: drop the existing manifest first
+    """
+    cur = conn.cursor()
+    if replace:
+        cur.execute("DROP TABLE IF EXISTS `load_manifest`;")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `load_manifest` (
+          `filename` varchar(255) COLLATE utf8_bin NOT NULL,
+          `checksum` char(64) COLLATE utf8_bin NOT NULL,
+          `loaded_at` datetime NOT NULL,
+          PRIMARY KEY (`filename`)
+        ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin;
+    """
+    )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def get_loaded_checksum(conn: Connection, filename: str):
+    """Checksum of a file recorded in `load_manifest`, or None if it was never loaded"""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT `checksum` FROM `load_manifest` WHERE `filename` = %s;", (filename,)
+    )
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def record_load(conn: Connection, filename: str, checksum: str) -> tuple:
+    """Record in `load_manifest` that a file with this checksum has been loaded"""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO `load_manifest` (`filename`, `checksum`, `loaded_at`)
+        VALUES (%s, %s, UTC_TIMESTAMP())
+        ON DUPLICATE KEY UPDATE `checksum` = VALUES(`checksum`), `loaded_at` = VALUES(`loaded_at`);
+    """,
+        (filename, checksum),
+    )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def index_pp_data_transactions(conn: Connection) -> tuple:
+    """Create index for `pp_data` table on "transaction_unique_identifier" column, used by record_status updates"""
+    cur = conn.cursor()
+    # Identifiers are 38-character GUIDs, so a prefix index covers them
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS TUIIndex ON pp_data (transaction_unique_identifier(38));"
+    )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def index_pp_data_dates(conn: Connection) -> tuple:
+    """Create index for `pp_data` table on "date_of_transfer" column, used to replace the rows of one year"""
+    cur = conn.cursor()
+    cur.execute("CREATE INDEX IF NOT EXISTS PPDateIndex ON pp_data (date_of_transfer);")
+
+    rows = cur.fetchall()
+    return rows
+
+
+def delete_pp_year(conn: Connection, year: int) -> int:
+    """
+    Delete the sales of one year from `pp_data`, before reloading its pp-YEAR.csv
+    :param conn: the Connection object
+    :param year: year of date_of_transfer
+    :return: number of rows deleted
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "DELETE FROM `pp_data` WHERE date_of_transfer BETWEEN %s AND %s;",
+        (f"{year}-01-01", f"{year}-12-31"),
+    )
+    return cur.rowcount
+
+
+def apply_pp_update(conn: Connection, filename: str, batch_size: int = 10_000) -> dict:
+    """
+    Apply a Land Registry price paid file to `pp_data` by record_status, in batches keyed by
+    transaction_unique_identifier: rows marked A are added, C replace the existing row and D delete it.
+    Every affected identifier is deleted before re-inserting, so applying the same file twice is harmless.
+    :param conn: the Connection object
+    :param filename: the csv file, in the pp-YEAR.csv format
+    :param batch_size: number of rows per batch
+    :return: number of rows added, changed and deleted, and the years of the affected transfers
+    """
+    insert_columns = [c for c in PP_COLUMNS if c != "db_id"]
+    insert_sql = (
+        f"INSERT INTO `pp_data` ({', '.join(f'`{c}`' for c in insert_columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(insert_columns))});"
+    )
+    counts = {"A": 0, "C": 0, "D": 0}
+    years = set()
+    cur = conn.cursor()
+    for batch in pd.read_csv(
+        filename,
+        names=insert_columns,
+        dtype=str,
+        keep_default_na=False,
+        chunksize=batch_size,
+    ):
+        # Keep the date part of "YYYY-MM-DD 00:00" for the date column
+        batch["date_of_transfer"] = batch["date_of_transfer"].str[:10]
+        identifiers = batch["transaction_unique_identifier"].tolist()
+        cur.execute(
+            f"DELETE FROM `pp_data` WHERE `transaction_unique_identifier` IN ({', '.join(['%s'] * len(identifiers))});",
+            identifiers,
+        )
+        inserts = batch[batch["record_status"] != "D"]
+        if len(inserts):
+            cur.executemany(
+                insert_sql, list(inserts.itertuples(index=False, name=None))
+            )
+        for status, count in batch["record_status"].value_counts().items():
+            if status in counts:
+                counts[status] += int(count)
+        years.update(batch["date_of_transfer"].str[:4].astype(int).unique().tolist())
+    counts["years"] = sorted(years)
+    return counts
+
+
+def ingest_incremental(
+    conn: Connection,
+    pp_filenames: list,
+    postcode_filename: str,
+    update_filenames: list = (),
+    batch_size: int = 10_000,
+) -> list:
+    """
+    Bring the database up to date without rebuilding it. Files whose checksum matches `load_manifest` are skipped.
+    A new or changed pp-YEAR.csv replaces every row of its year, so rows removed from the file, or inserted by
+    monthly updates before it, are not left behind; other new price paid files are bulk loaded. Monthly update files, and changed price paid files that are not
+    named by year, are applied by record_status through apply_pp_update. A changed postcode file replaces
+    `postcode_data`.
+    :param conn: the Connection object
+    :param pp_filenames: yearly price paid files
+    :param postcode_filename: the postcode file
+    :param update_filenames: monthly update files
+    :param batch_size: number of rows per batch of apply_pp_update
+    :return: list of (filename, action) pairs
+    """
+    setup_load_manifest(conn)
+    setup_price_stats(conn)
+    if not table_exists(conn, "pp_data"):
+        setup_pp_data(conn)
+    index_pp_data_transactions(conn)
+    index_pp_data_dates(conn)
+
+    actions = []
+    # Years whose statistics need refreshing, or None once every year does
+    changed_years = set()
+    for filename in list(pp_filenames) + list(update_filenames):
+        if not os.path.isfile(filename):
+            print(f">>>File {filename} doesn't exist, skipped.")
+            continue
+        checksum = file_checksum(filename)
+        loaded = get_loaded_checksum(conn, filename)
+        if loaded == checksum:
+            print(f"{filename} unchanged, skipped.")
+            actions.append((filename, "skipped"))
+            continue
+        start = time.perf_counter()
+        match = re.fullmatch(r"pp-(\d{4})\.csv", os.path.basename(filename))
+        if filename in update_filenames or (loaded is not None and match is None):
+            print(f"Applying {filename} to pp_data...")
+            counts = apply_pp_update(conn, filename, batch_size)
+            print(f"{counts['A']} added, {counts['C']} changed, {counts['D']} deleted")
+            actions.append((filename, "updated"))
+            if changed_years is not None:
+                changed_years.update(counts["years"])
+        elif match is None:
+            print(f"Loading {filename} to pp_data...")
+            upload_csv_to_table(conn, filename, "pp_data")
+            actions.append((filename, "loaded"))
+            changed_years = None
+        else:
+            # Replace the whole year, including sales monthly updates inserted before the yearly file arrived;
+            # the manifest is recorded last, so an interrupted reload is redone
+            year = int(match.group(1))
+            print(f"Loading {filename} to pp_data, replacing {year}...")
+            deleted = delete_pp_year(conn, year)
+            upload_csv_to_table(conn, filename, "pp_data")
+            print(f"{deleted} rows replaced")
+            actions.append((filename, "loaded" if loaded is None else "replaced"))
+            if changed_years is not None:
+                changed_years.add(year)
+        record_load(conn, filename, checksum)
+        print(f"Done in {time.perf_counter() - start:.1f}s")
+
+    if os.path.isfile(postcode_filename):
+        checksum = file_checksum(postcode_filename)
+        if get_loaded_checksum(conn, postcode_filename) == checksum:
+            print(f"{postcode_filename} unchanged, skipped.")
+            actions.append((postcode_filename, "skipped"))
+        else:
+            print(f"Loading {postcode_filename} to postcode_data...")
+            setup_postcode_data(conn)
+            upload_csv_to_table(conn, postcode_filename, "postcode_data")
+            index_postcode_data(conn)
+            record_load(conn, postcode_filename, checksum)
+            actions.append((postcode_filename, "loaded"))
+            # Coordinates may have moved for every year
+            changed_years = None
+
+    if table_exists(conn, "postcode_data"):
+        index_filter_columns(conn)
+    if changed_years is None:
+        refresh_price_stats(conn)
+    elif changed_years:
+        refresh_price_stats(conn, sorted(changed_years))
+
+    # Keep a materialized `prices_coordinates_data` in step with the changes
+    if table_exists(conn, "prices_coordinates_progress"):
+        if changed_years is None:
+            build_prices_coordinates_data(conn, rebuild=True)
+        elif changed_years:
+            build_prices_coordinates_data(conn, sorted(changed_years), rebuild=True)
+    return actions
+
+
+PRICE_STATS_COLUMNS = [
+    "year",
+    "property_type",
+    "row_count",
+    "min_price",
+    "max_price",
+    "min_date",
+    "max_date",
+    "min_latitude",
+    "max_latitude",
+    "min_longitude",
+    "max_longitude",
+]
+
+
+def setup_price_stats(conn: Connection, replace: bool = False) -> tuple:
+    """Create `price_stats` table holding per-year, per-property_type statistics of the pp_data/postcode_data join
+    :param conn: the Connection object
+    :param replace: drop the existing statistics first
+    """
+    cur = conn.cursor()
+    if replace:
+        cur.execute("DROP TABLE IF EXISTS `price_stats`;")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `price_stats` (
+          `year` smallint unsigned NOT NULL,
+          `property_type` varchar(1) COLLATE utf8_bin NOT NULL,
+          `row_count` bigint unsigned NOT NULL,
+          `min_price` int(10) unsigned NOT NULL,
+          `max_price` int(10) unsigned NOT NULL,
+          `min_date` date NOT NULL,
+          `max_date` date NOT NULL,
+          `min_latitude` decimal(11,8),
+          `max_latitude` decimal(11,8),
+          `min_longitude` decimal(10,8),
+          `max_longitude` decimal(10,8),
+          PRIMARY KEY (`year`, `property_type`)
+        ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin;
+    """
+    )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def refresh_price_stats(conn: Connection, years: list = None) -> tuple:
+    """
+    Recompute `price_stats` in one grouped scan, for the given years only if any.
+    Deletions can lower a maximum, so affected years are recomputed rather than adjusted.
+    :param conn: the Connection object
+    :param years: years to recompute, all years by default
+    """
+    cur = conn.cursor()
+    if years is None:
+        cur.execute("DELETE FROM `price_stats`;")
+        where = ""
+        args = ()
+    else:
+        placeholders = ", ".join(["%s"] * len(years))
+        cur.execute(
+            f"DELETE FROM `price_stats` WHERE `year` IN ({placeholders});", years
+        )
+        # A range on the date keeps an index on date_of_transfer usable
+        where = (
+            "WHERE pp.date_of_transfer BETWEEN %s AND %s "
+            f"AND YEAR(pp.date_of_transfer) IN ({placeholders})"
+        )
+        args = (f"{min(years)}-01-01", f"{max(years)}-12-31", *years)
+    print("Computing price statistics...")
+    cur.execute(
+        f"""
+        INSERT INTO `price_stats`
+        SELECT YEAR(pp.date_of_transfer), pp.property_type, COUNT(*),
+        MIN(pp.price), MAX(pp.price), MIN(pp.date_of_transfer), MAX(pp.date_of_transfer),
+        MIN(pc.latitude), MAX(pc.latitude), MIN(pc.longitude), MAX(pc.longitude)
+        FROM pp_data AS pp
+        LEFT JOIN postcode_data AS pc
+        ON pc.postcode=pp.postcode
+        {where}
+        GROUP BY YEAR(pp.date_of_transfer), pp.property_type ;
+    """,
+        args,
+    )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def get_price_stats(conn: Connection) -> pd.DataFrame:
+    """Read the maintained `price_stats` table, a few hundred rows at most"""
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(PRICE_STATS_COLUMNS)} FROM `price_stats`;")
+    stats = pd.DataFrame(cur.fetchall(), columns=PRICE_STATS_COLUMNS)
+    for column in ["min_latitude", "max_latitude", "min_longitude", "max_longitude"]:
+        stats[column] = stats[column].astype("float64")
+    return stats
+
+
+def price_stats_from_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """Compute the statistics of `price_stats` from an in-memory joined dataset, in one grouped pass"""
+    dates = parse_dates(df["date_of_transfer"])
+    grouped = df.assign(year=dates.dt.year, date=dates).groupby(
+        ["year", "property_type"], observed=True
+    )
+    stats = grouped.agg(
+        row_count=("price", "size"),
+        min_price=("price", "min"),
+        max_price=("price", "max"),
+        min_date=("date", "min"),
+        max_date=("date", "max"),
+        min_latitude=("latitude", "min"),
+        max_latitude=("latitude", "max"),
+        min_longitude=("longitude", "min"),
+        max_longitude=("longitude", "max"),
+    ).reset_index()
+    return stats[PRICE_STATS_COLUMNS]
+
+
+def count_from_stats(
+    stats: pd.DataFrame, years: range = None, property_types: list = None
+) -> int:
+    """Number of rows for the given years and property types, answered from price statistics without a scan"""
+    selected = stats
+    if years is not None:
+        selected = selected[selected["year"].isin(list(years))]
+    if property_types is not None:
+        selected = selected[selected["property_type"].isin(list(property_types))]
+    return int(selected["row_count"].sum())
+
+
+def setup_prices_coordinates_progress(conn: Connection, replace: bool = False) -> tuple:
+    """Create `prices_coordinates_progress` table recording the years built into `prices_coordinates_data`
+    :param conn: the Connection object
+    :param replace: drop the existing progress first, so every year is rebuilt
+    """
+    cur = conn.cursor()
+    if replace:
+        cur.execute("DROP TABLE IF EXISTS `prices_coordinates_progress`;")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `prices_coordinates_progress` (
+          `year` smallint unsigned NOT NULL,
+          `row_count` bigint unsigned NOT NULL,
+          `built_at` datetime NOT NULL,
+          PRIMARY KEY (`year`)
+        ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin;
+    """
+    )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def drop_prices_coordinates_data(conn: Connection) -> tuple:
+    """Drop `prices_coordinates_data` and its `prices_coordinates_progress`, so select_prices reads the join"""
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS `prices_coordinates_progress`;")
+    cur.execute("DROP TABLE IF EXISTS `prices_coordinates_data`;")
+
+    rows = cur.fetchall()
+    return rows
+
+
+def build_prices_coordinates_data(
+    conn: Connection, years: list = None, rebuild: bool = False
+) -> dict:
+    """
+    Fill `prices_coordinates_data` from the pp_data/postcode_data join, one transaction per year.
+    Finished years are recorded in `prices_coordinates_progress`, so an interrupted build resumes where it stopped.
+    Sales whose postcode has no coordinates are left out, as the coordinates of the table are NOT NULL.
+    :param conn: the Connection object
+    :param years: years to build, every year of `price_stats` by default, when built years that are no longer
+        in `price_stats` are deleted too
+    :param rebuild: rebuild years that were already built, e.g. after new price data arrived
+    :return: number of rows built per year
+    """
+    setup_prices_coordinates_data(conn, replace=False)
+    setup_prices_coordinates_progress(conn)
+    # The per-year deletes below filter on date_of_transfer alone
+    index_prices_coordinates_dates(conn)
+
+    cur = conn.cursor()
+    cur.execute("SELECT `year` FROM `prices_coordinates_progress`;")
+    built = {row[0] for row in cur.fetchall()}
+    if years is None:
+        years = sorted(get_price_stats(conn)["year"].unique().tolist())
+        for year in sorted(built - set(years)):
+            print(f"Deleting {year}, no longer in the price data...")
+            conn.begin()
+            try:
+                cur.execute(
+                    "DELETE FROM `prices_coordinates_data` WHERE date_of_transfer BETWEEN %s AND %s;",
+                    (f"{year}-01-01", f"{year}-12-31"),
+                )
+                cur.execute(
+                    "DELETE FROM `prices_coordinates_progress` WHERE `year` = %s;",
+                    (year,),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            built.discard(year)
+
+    todo = [year for year in years if rebuild or year not in built]
+    print(f"Building prices_coordinates_data for {len(todo)} of {len(years)} years...")
+
+    columns = ", ".join(PCD_COLUMNS)
+    select = ", ".join(
+        f"pc.{column}"
+        if column in ["country", "latitude", "longitude"]
+        else f"pp.{column}"
+        for column in PCD_COLUMNS
+    )
+    counts = {}
+    for i, year in enumerate(todo):
+        start = time.perf_counter()
+        bounds = (f"{year}-01-01", f"{year}-12-31")
+        conn.begin()
+        try:
+            cur.execute(
+                "DELETE FROM `prices_coordinates_data` WHERE date_of_transfer BETWEEN %s AND %s;",
+                bounds,
+            )
+            cur.execute(
+                f"""
+                INSERT INTO `prices_coordinates_data` ({columns})
+                SELECT {select}
+                FROM pp_data AS pp
+                INNER JOIN postcode_data AS pc
+                ON pc.postcode=pp.postcode
+                WHERE pp.date_of_transfer BETWEEN %s AND %s ;
+            """,
+                bounds,
+            )
+            counts[year] = cur.rowcount
+            cur.execute(
+                """
+                INSERT INTO `prices_coordinates_progress` (`year`, `row_count`, `built_at`)
+                VALUES (%s, %s, UTC_TIMESTAMP())
+                ON DUPLICATE KEY UPDATE `row_count` = VALUES(`row_count`), `built_at` = VALUES(`built_at`);
+            """,
+                (year, counts[year]),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(
+            f"[{i + 1}/{len(todo)}] {year}: {counts[year]} rows in {time.perf_counter() - start:.1f}s"
+        )
+
+    index_prices_coordinates_data(conn)
+    print("Done")
+    return counts
+
+
+def prices_source(conn: Connection) -> str:
+    """
+    The source select_prices should read: "prices_coordinates_data" once every year of `price_stats`
+    has been built into it, otherwise "join"
+    """
+    if not table_exists(conn, "prices_coordinates_progress"):
+        return "join"
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM (SELECT DISTINCT `year` FROM `price_stats`) AS s
+        LEFT JOIN `prices_coordinates_progress` AS p ON p.`year` = s.`year`
+        WHERE p.`year` IS NULL;
+    """
+    )
+    missing = cur.fetchone()[0]
+    return "join" if missing else "prices_coordinates_data"
+
+
 def count_number_of_rows(conn: Connection, table: str) -> tuple:
     """
     Query number of rows of the table
@@ -462,17 +1667,13 @@ def count_number_of_rows(conn: Connection, table: str) -> tuple:
 def index_postcode_data(conn: Connection) -> tuple:
     """Create index for `postcode_data` table on "postcode" column"""
     cur = conn.cursor()
-    cur.execute("CREATE INDEX PCIndex ON postcode_data (postcode);")
+    cur.execute("CREATE INDEX IF NOT EXISTS PCIndex ON postcode_data (postcode);")
 
     rows = cur.fetchall()
     return rows
 
 
-def join_pp_pc(conn: Connection) -> tuple:
-    """Join `pp_data` and `postcode_data` on "postcode" column"""
-    cur = conn.cursor()
-    cur.execute(
-        """        
+JOIN_PP_PC_SQL = """
         SELECT pp.price, pp.date_of_transfer, pp.postcode, pp.property_type, 
         pp.new_build_flag, pp.tenure_type, pp.locality, pp.town_city, pp.district, 
         pp.county, pc.country, pc.latitude, pc.longitude
@@ -480,6 +1681,222 @@ def join_pp_pc(conn: Connection) -> tuple:
         LEFT JOIN postcode_data AS pc
         ON pc.postcode=pp.postcode ;
         """
+
+
+def join_pp_pc(conn: Connection) -> tuple:
+    """Join `pp_data` and `postcode_data` on "postcode" column"""
+    cur = conn.cursor()
+    cur.execute(JOIN_PP_PC_SQL)
+    rows = cur.fetchall()
+    return rows
+
+
+def iter_query(
+    conn: Connection,
+    sql_command: str,
+    columns: list = None,
+    chunksize: int = 100_000,
+    args=None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Run a query through an unbuffered server-side cursor and yield the result in data frame chunks
+    :param conn: the Connection object
+    :param sql_command: the query to run
+    :param columns: column names of the result, taken from the cursor description by default
+    :param chunksize: number of rows per chunk
+    :param args: parameters of the query
+    """
+    cur = conn.cursor(SSCursor)
+    try:
+        cur.execute(sql_command, args)
+        if columns is None:
+            columns = [d[0] for d in cur.description]
+        while True:
+            rows = cur.fetchmany(chunksize)
+            if not rows:
+                break
+            yield pd.DataFrame(rows, columns=columns)
+    finally:
+        # Closing an unbuffered cursor drains any rows left on the connection
+        cur.close()
+
+
+def iter_join_pp_pc(
+    conn: Connection, chunksize: int = 100_000, compact: bool = True
+) -> Iterator[pd.DataFrame]:
+    """Join `pp_data` and `postcode_data` on "postcode" column, yielding typed data frame chunks
+    :param conn: the Connection object
+    :param chunksize: number of rows per chunk
+    :param compact: convert each chunk to the compact schema of to_compact
+    """
+    for chunk in iter_query(conn, JOIN_PP_PC_SQL, PCD_COLUMNS, chunksize):
+        chunk = _type_pcd_chunk(chunk)
+        yield to_compact(chunk) if compact else chunk
+
+
+def _type_pcd_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the Decimal coordinates and date objects returned by pymysql to numpy dtypes"""
+    if "price" in df.columns:
+        df["price"] = df["price"].astype("int64")
+    if "date_of_transfer" in df.columns:
+        df["date_of_transfer"] = parse_dates(df["date_of_transfer"])
+    for column in ["latitude", "longitude"]:
+        if column in df.columns:
+            df[column] = df[column].astype("float64")
+    return df
+
+
+def index_filter_columns(conn: Connection) -> tuple:
+    """
+    Create the composite indexes used by select_prices and count_prices on the pp_data/postcode_data join:
+    postcodes by coordinates, and sales by postcode, property_type and date_of_transfer
+    """
+    cur = conn.cursor()
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS PCLocIndex ON postcode_data (latitude, longitude, postcode);"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS PPFilterIndex ON pp_data (postcode, property_type, date_of_transfer);"
     )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def index_prices_coordinates_dates(conn: Connection) -> tuple:
+    """Create index for `prices_coordinates_data` table on "date_of_transfer" column, used to rebuild one year"""
+    cur = conn.cursor()
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS PCDTransferIndex ON prices_coordinates_data (date_of_transfer);"
+    )
+
     rows = cur.fetchall()
     return rows
+
+
+def index_prices_coordinates_data(conn: Connection) -> tuple:
+    """
+    Create the composite indexes used by select_prices and count_prices on `prices_coordinates_data`:
+    property_type then coordinates for bounding boxes, and property_type then date_of_transfer for date ranges
+    """
+    cur = conn.cursor()
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS PCDLocIndex
+        ON prices_coordinates_data (property_type, latitude, longitude, date_of_transfer);
+    """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS PCDDateIndex
+        ON prices_coordinates_data (property_type, date_of_transfer);
+    """
+    )
+
+    rows = cur.fetchall()
+    return rows
+
+
+def _prices_filter(
+    source: str,
+    bounding_box: tuple = None,
+    date_range: tuple = None,
+    property_types: list = None,
+) -> tuple:
+    """Build the FROM and WHERE clauses, and their parameters, of select_prices and count_prices"""
+    if source == "prices_coordinates_data":
+        from_clause = "FROM prices_coordinates_data AS pcd"
+        sales, places = "pcd", "pcd"
+    elif source == "join":
+        # Rows without coordinates can never match a bounding box, so the join only needs to be inner then
+        join = "LEFT JOIN" if bounding_box is None else "INNER JOIN"
+        from_clause = (
+            f"FROM pp_data AS pp {join} postcode_data AS pc ON pc.postcode=pp.postcode"
+        )
+        sales, places = "pp", "pc"
+    else:
+        raise ValueError(f"Unknown source {source}.")
+
+    conditions = []
+    args = []
+    if bounding_box is not None:
+        north, south, west, east = bounding_box
+        conditions += [
+            f"{places}.latitude < %s",
+            f"{places}.latitude > %s",
+            f"{places}.longitude < %s",
+            f"{places}.longitude > %s",
+        ]
+        args += [north, south, east, west]
+    if date_range is not None:
+        date_lb, date_ub = date_range
+        conditions += [
+            f"{sales}.date_of_transfer > %s",
+            f"{sales}.date_of_transfer < %s",
+        ]
+        args += [pd.Timestamp(date_lb).date(), pd.Timestamp(date_ub).date()]
+    if property_types is not None:
+        property_types = list(property_types)
+        conditions.append(
+            f"{sales}.property_type IN ({', '.join(['%s'] * len(property_types))})"
+        )
+        args += property_types
+
+    where_clause = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return from_clause, where_clause, sales, places, args
+
+
+def select_prices(
+    conn: Connection,
+    bounding_box: tuple = None,
+    date_range: tuple = None,
+    property_types: list = None,
+    columns: list = None,
+    source: str = "prices_coordinates_data",
+    chunksize: int = 100_000,
+    compact: bool = True,
+) -> pd.DataFrame:
+    """
+    Select only the sales matching a bounding box, date range and property types, filtered by the database.
+    Bounds are exclusive, as in address._get_pcd_data.
+    :param conn: the Connection object
+    :param bounding_box: (north, south, west, east)
+    :param date_range: (lower, upper) bounds of date_of_transfer
+    :param property_types: property_type codes to keep
+    :param columns: columns to return, all of PCD_COLUMNS by default
+    :param source: "prices_coordinates_data", or "join" to query pp_data joined with postcode_data
+    :param chunksize: number of rows fetched at a time through a server-side cursor
+    :param compact: return the compact schema of to_compact
+    """
+    from_clause, where_clause, sales, places, args = _prices_filter(
+        source, bounding_box, date_range, property_types
+    )
+    if columns is None:
+        columns = PCD_COLUMNS
+    place_columns = ["country", "latitude", "longitude"]
+    select = ", ".join(
+        f"{places if column in place_columns else sales}.{column}" for column in columns
+    )
+    sql_command = f"SELECT {select} {from_clause} {where_clause} ;"
+    chunks = (
+        _type_pcd_chunk(chunk)
+        for chunk in iter_query(conn, sql_command, columns, chunksize, args)
+    )
+    df = concat_chunks(to_compact(chunk) if compact else chunk for chunk in chunks)
+    return df
+
+
+def count_prices(
+    conn: Connection,
+    bounding_box: tuple = None,
+    date_range: tuple = None,
+    property_types: list = None,
+    source: str = "prices_coordinates_data",
+) -> int:
+    """Count the sales matching a bounding box, date range and property types, see select_prices"""
+    from_clause, where_clause, sales, places, args = _prices_filter(
+        source, bounding_box, date_range, property_types
+    )
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) {from_clause} {where_clause} ;", args)
+    return int(cur.fetchone()[0])
@@ -15,30 +15,238 @@ import tensorflow as tf
 import scipy.stats"""
 
 import datetime
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 
 import numpy as np
 import pandas as pd
 import sklearn
 
-from . import assess
+from . import access, assess
+from .config import *
 
 """Address a particular question that arises from the data"""
 
 
 def predict_price(
-    dataset, latitude, longitude, date, property_type
+    dataset,
+    latitude,
+    longitude,
+    date,
+    property_type,
+    stats=None,
+    box_index=None,
+    model_cache=None,
+    regression_grid=None,
+    neighbour_index=None,
 ) -> tuple[float, list, tuple]:
     """Price prediction for UK housing.
     Returns R2 score on validation dataset, prediction result,
-    and the bounding box where the learning dataset was selected"""
+    and the bounding box where the learning dataset was selected.
+    dataset may be a data frame, a PreparedDataset, or a database Connection
+    stats are optional price statistics of the dataset, from access.get_price_stats or price_stats_from_dataframe
+    box_index is an optional BoxCountIndex of the dataset, to choose the bounding box without scanning
+    model_cache is an optional ModelCache of the dataset, to reuse the model fitted for a nearby earlier query
+    regression_grid is an optional RegressionGrid of the dataset, to fit the model from its cell statistics
+    neighbour_index is an optional NeighbourIndex of the dataset, to learn from the nearest sales instead of a box;
+    model_cache and regression_grid are then not used
+    """
 
-    # Construct learning set: near (latitude, longitude), all dates, of same property_type
-    dataset, bounding_box = get_learning_dataset(
-        dataset, latitude, longitude, date, property_type
+    if neighbour_index is not None or (model_cache is None and regression_grid is None):
+        # Construct learning set: near (latitude, longitude), all dates, of same property_type
+        dataset, bounding_box = get_learning_dataset(
+            dataset,
+            latitude,
+            longitude,
+            date,
+            property_type,
+            stats,
+            box_index,
+            neighbour_index,
+        )
+        reg, score_R2 = _fit_local_model(dataset)
+    else:
+        date_range = _get_date_range(date)
+        fitted = None
+        if model_cache is None:
+            centre = (latitude, longitude)
+        else:
+            centre = model_cache.centre(latitude, longitude)
+            key = (property_type, centre, date_range)
+            fitted = model_cache.get(key)
+        if fitted is None:
+            data, bounding_box = _get_learning_bounding_box(
+                dataset, *centre, date_range, property_type, stats, box_index
+            )
+            reg, score_R2 = _fit_in_box(
+                data, bounding_box, date_range, property_type, regression_grid
+            )
+            if model_cache is not None:
+                model_cache.put(key, (reg, score_R2, bounding_box))
+        else:
+            reg, score_R2, bounding_box = fitted
+
+    x_pred_design = _prediction_design(
+        [latitude], [longitude], [date], bounding_box, property_type
+    )
+    y_pred = reg.predict(x_pred_design[reg.feature_names_in_])
+
+    return score_R2, y_pred, bounding_box
+
+
+def predict_prices(
+    dataset,
+    queries: pd.DataFrame,
+    box_index=None,
+    model_cache=None,
+    regression_grid=None,
+    resolution: float = None,
+) -> pd.DataFrame:
+    """Price predictions for a batch of queries, sharing the data preparation between them.
+    queries has columns latitude, longitude, date and property_type.
+    The bounding box is searched around each query location rounded to resolution degrees, so nearby queries
+    of a property type end up with the same bounding box and date range, and share one learning dataset
+    and one fitted model. Results are matched to queries by position, so queries.index may repeat labels.
+    model_cache is an optional ModelCache of the dataset, to reuse models across batches.
+    regression_grid is an optional RegressionGrid of the dataset, to fit the models from its cell statistics.
+    resolution is the resolution of model_cache if given, model_cache_resolution of the config otherwise;
+    0 searches around the exact query locations.
+    Returns, for each query, the R2 score on the validation dataset, the prediction, and the bounding box.
+    """
+
+    if not len(queries.index):
+        return _empty_predictions(queries.index)
+    if resolution is None:
+        if model_cache is None:
+            resolution = config.get("model_cache_resolution", 0.005)
+        else:
+            resolution = model_cache.resolution
+    # Prepared on the first query the model cache cannot answer
+    data = None
+
+    # Work by position, so duplicate labels in queries.index are kept apart
+    latitudes = queries["latitude"].to_numpy()
+    longitudes = queries["longitude"].to_numpy()
+    dates = queries["date"].to_numpy()
+    property_types = queries["property_type"].to_numpy()
+    models = {}
+    fits = {}
+    cache_keys = {}
+    for position in range(len(queries.index)):
+        property_type = property_types[position]
+        date_range = _get_date_range(dates[position])
+        fitted = None
+        centre = _grid_centre(latitudes[position], longitudes[position], resolution)
+        if model_cache is not None:
+            key = (property_type, centre, date_range)
+            fitted = model_cache.get(key)
+        if fitted is None:
+            if data is None:
+                data = prepare(dataset)
+                if box_index is None:
+                    box_index = data.box_index
+            bounding_box = _get_bounding_box_indexed(
+                *centre,
+                data,
+                date_range,
+                property_type,
+                box_index,
+            )
+            group = (property_type, bounding_box, date_range)
+            if model_cache is not None:
+                cache_keys.setdefault(group, set()).add(key)
+        else:
+            reg, score_R2, bounding_box = fitted
+            group = (property_type, bounding_box, date_range)
+            fits[group] = (reg, score_R2)
+        models.setdefault(group, []).append(position)
+
+    results = np.empty((len(queries.index), 6))
+    for group, members in models.items():
+        property_type, bounding_box, date_range = group
+        if group not in fits:
+            fits[group] = _fit_in_box(
+                data, bounding_box, date_range, property_type, regression_grid
+            )
+        reg, score_R2 = fits[group]
+        for key in cache_keys.get(group, ()):
+            model_cache.put(key, (reg, score_R2, bounding_box))
+
+        x_pred_design = _prediction_design(
+            latitudes[members],
+            longitudes[members],
+            dates[members],
+            bounding_box,
+            property_type,
+        )
+        results[members, 0] = score_R2
+        results[members, 1] = reg.predict(x_pred_design[reg.feature_names_in_])
+        results[members, 2:] = bounding_box
+
+    return pd.DataFrame(results, columns=PREDICTION_COLUMNS, index=queries.index)
+
+
+PREDICTION_COLUMNS = ["r2", "prediction", "north", "south", "west", "east"]
+
+
+def _empty_predictions(index: pd.Index) -> pd.DataFrame:
+    """The result of predict_prices for no queries, with its columns and dtypes"""
+    return pd.DataFrame(
+        {column: pd.Series(dtype=float) for column in PREDICTION_COLUMNS},
+        index=index[:0],
     )
-    dataset.loc[:, "date_of_transfer"] = dataset["date_of_transfer"].apply(
-        lambda x: round(x.value / (24 * 60 * 60 * 1e9))
+
+
+def _prediction_design(
+    latitudes, longitudes, dates, bounding_box, property_type
+) -> pd.DataFrame:
+    """Features of the locations and dates to predict, from the bounding box of their learning dataset"""
+    dates = pd.Series(np.asarray(dates))
+    x_pred_design = pd.DataFrame(
+        {
+            "latitude": np.asarray(latitudes, dtype="float64"),
+            "longitude": np.asarray(longitudes, dtype="float64"),
+            "date_of_transfer": access.to_epoch_days(dates).to_numpy(),
+        },
+        index=latitudes.index if isinstance(latitudes, pd.Series) else None,
     )
+    osm_features = _get_OSM_features(
+        bounding_box, _get_date_range(dates.iloc[0]), property_type
+    )
+    return _join_pcd_osm(x_pred_design, pd.DataFrame(osm_features, columns=None))
+
+
+def _fit_in_box(
+    data,
+    bounding_box,
+    date_range,
+    property_type,
+    regression_grid=None,
+) -> tuple:
+    """Fit the local model in a bounding box.
+    The model is fitted from the regression grid if there is one, and from the learning dataset otherwise
+    or when the grid has too few sales in the box."""
+    fitted = None
+    if regression_grid is not None:
+        fitted = regression_grid.fit(bounding_box, date_range, property_type)
+    if fitted is None or fitted[0] is None:
+        fitted = _fit_local_model(
+            _select_learning_dataset(data, bounding_box, date_range, property_type)
+        )
+    return fitted
+
+
+def _fit_local_model(dataset: pd.DataFrame) -> tuple:
+    """Fit the linear model of predict_price on a learning dataset.
+    Returns the fitted model and its R2 score on the validation split."""
+    if not pd.api.types.is_integer_dtype(dataset["date_of_transfer"]):
+        dataset = dataset.assign(
+            date_of_transfer=access.to_epoch_days(dataset["date_of_transfer"])
+        )
 
     # Split the dataset
     idx = np.arange(len(dataset))
@@ -49,57 +257,115 @@ def predict_price(
     # Linear regression model
     model = sklearn.linear_model.LinearRegression()
 
-    # We assume price is near-linear to longitude & latitude within a small bounding box
-    x_design = train_set.loc[
-        :,
-        [
-            "latitude",
-            "longitude",
-            "date_of_transfer",
-        ],
-    ]
+    # We assume price is near-linear to longitude & latitude within a small bounding box,
+    # and to the counts of points of interest around each sale, when _join_pcd_osm has added them
+    features = [
+        "latitude",
+        "longitude",
+        "date_of_transfer",
+    ] + [column for column in dataset.columns if column.startswith("osm_")]
+    x_design = train_set.loc[:, features]
     reg = model.fit(x_design, train_set.loc[:, "price"])
 
-    x_val_design = val_set.loc[
-        :,
-        [
-            "latitude",
-            "longitude",
-            "date_of_transfer",
-        ],
-    ]
+    x_val_design = val_set.loc[:, features]
     score_R2 = reg.score(x_val_design, val_set.loc[:, "price"])
     # print(f"R2: {score_R2}")
 
-    x_pred_design = pd.DataFrame(
-        [
-            [
-                latitude,
-                longitude,
-                round(pd.to_datetime(date).value / (24 * 60 * 60 * 1e9)),
-            ]
-        ],
-        columns=["latitude", "longitude", "date_of_transfer"],
-    )
-    y_pred = reg.predict(x_pred_design)
-
-    return score_R2, y_pred, bounding_box
+    return reg, score_R2
 
 
 def get_learning_dataset(
-    dataset, latitude, longitude, date, property_type
+    dataset,
+    latitude,
+    longitude,
+    date,
+    property_type,
+    stats=None,
+    box_index=None,
+    neighbour_index=None,
 ) -> tuple[pd.DataFrame, tuple]:
     """Load and merge data for model learning.
-    Returns a dataset and the bounding box from which the data were selected."""
-
-    # data = pd.read_csv("./local_data/prices_coordinates_data.csv")
-    # data.loc[:, "date_of_transfer"] = pd.to_datetime(data["date_of_transfer"])
-    data = assess.labelled(assess.data(dataset))
+    Returns a dataset and the bounding box from which the data were selected.
+    dataset may also be a PreparedDataset, prepared once for many calls,
+    or a database Connection, in which case only the selected rows are fetched.
+    With a NeighbourIndex of the dataset, the dataset is its k sales nearest to the location rather than the sales
+    in a bounding box, and the bounding box returned is the one of these sales.
+    """
 
     date_range = _get_date_range(date)
-    bounding_box = _get_bounding_box(
-        latitude, longitude, data, date_range, property_type
+    if neighbour_index is not None:
+        data_subset = neighbour_index.query(
+            latitude, longitude, property_type, date_range
+        )
+        bounding_box = _get_bounds(data_subset, latitude, longitude)
+        osm_features = pd.DataFrame(
+            _get_OSM_features(bounding_box, date_range, property_type), columns=None
+        )
+        return _join_pcd_osm(data_subset, osm_features), bounding_box
+
+    data, bounding_box = _get_learning_bounding_box(
+        dataset, latitude, longitude, date_range, property_type, stats, box_index
     )
+    train_set = _select_learning_dataset(data, bounding_box, date_range, property_type)
+    return train_set, bounding_box
+
+
+def _get_learning_bounding_box(
+    dataset, latitude, longitude, date_range, property_type, stats=None, box_index=None
+) -> tuple:
+    """Choose the bounding box of the learning dataset around (latitude, longitude).
+    Returns the data to select the learning dataset from, and the bounding box.
+    For a database Connection the box is chosen with COUNT queries filtered by the database.
+    """
+
+    if isinstance(dataset, PreparedDataset):
+        data = dataset
+    elif isinstance(dataset, pd.DataFrame):
+        # data = pd.read_csv("./local_data/prices_coordinates_data.csv")
+        # data.loc[:, "date_of_transfer"] = pd.to_datetime(data["date_of_transfer"])
+        data = assess.labelled(assess.data(dataset))
+    else:
+        bounding_box = _get_bounding_box_from_db(
+            latitude,
+            longitude,
+            dataset,
+            date_range,
+            property_type,
+            access.prices_source(dataset),
+            stats,
+        )
+        return dataset, bounding_box
+
+    if box_index is not None:
+        bounding_box = _get_bounding_box_indexed(
+            latitude, longitude, data, date_range, property_type, box_index
+        )
+    else:
+        bounding_box = _get_bounding_box(
+            latitude, longitude, data, date_range, property_type, stats
+        )
+    return data, bounding_box
+
+
+def _select_learning_dataset(
+    data, bounding_box, date_range, property_type
+) -> pd.DataFrame:
+    """Select the learning dataset in a bounding box, from the data of _get_learning_bounding_box"""
+    if not isinstance(data, (pd.DataFrame, PreparedDataset)):
+        return access.select_prices(
+            data,
+            bounding_box,
+            date_range,
+            [property_type],
+            columns=[
+                "price",
+                "latitude",
+                "longitude",
+                "date_of_transfer",
+                "property_type",
+            ],
+            source=access.prices_source(data),
+        )
 
     # Get features about surrounding buildings (over history?) from OpenStreetMap
     # OSM features don't contribute a lot of information that are stable and not reflected in house prices, so ignored
@@ -113,41 +379,132 @@ def get_learning_dataset(
 
     # Currently only takes data_subset, osm_features ignored
     train_set = _join_pcd_osm(data_subset, osm_features)
-    return train_set, bounding_box
+    return train_set
+
+
+def _get_bounds(data: pd.DataFrame, latitude, longitude) -> tuple:
+    """Bounding box (north, south, west, east) of the sales, or of the location if there are none"""
+    if len(data.index) == 0:
+        return latitude, latitude, longitude, longitude
+    return (
+        float(data.latitude.max()),
+        float(data.latitude.min()),
+        float(data.longitude.min()),
+        float(data.longitude.max()),
+    )
+
 
+# Tile cache of OpenStreetMap points of interest, see _get_osm_tiles, and the key it was opened for
+_osm_tiles = None
+_osm_tiles_key = None
 
-def _get_OSM_features(bounding_box, date_range, property_type) -> tuple:
+
+def _get_osm_tiles():
+    """The OSM tile cache at osm_tile_cache of the config, written by access.write_osm_tiles, or None if there is
+    none. It is opened again when the root, the tile cache size, or the tiles written there change.
+    """
+    global _osm_tiles, _osm_tiles_key
+    root = config.get("osm_tile_cache")
+    meta = os.path.join(root, "tiles.yml") if root else None
+    if meta is None or not os.path.isfile(meta):
+        return None
+    size = config.get("osm_tile_cache_size", 1024)
+    key = (os.path.abspath(root), size, os.path.getmtime(meta))
+    if _osm_tiles is None or _osm_tiles_key != key:
+        _osm_tiles = access.OSMTiles(root, size)
+        _osm_tiles_key = key
+    return _osm_tiles
+
+
+def reset_osm_tiles() -> None:
+    """Forget the opened OSM tile cache, so the next prediction opens it again"""
+    global _osm_tiles, _osm_tiles_key
+    _osm_tiles = None
+    _osm_tiles_key = None
+
+
+def _get_OSM_features(bounding_box, date_range, property_type):
+    """Points of interest around the bounding box, read from the local OSM tile cache.
+    Returns (0,), no features, if there is no tile cache."""
     north, south, west, east = bounding_box
     date_lb, date_ub = date_range
-    return (0,)
+    tiles = _get_osm_tiles()
+    if tiles is None:
+        return (0,)
+
+    # Points of interest within the radius of the sales near the edges of the box too
+    radius = config.get("osm_radius", 0.5) / NeighbourIndex.EARTH_RADIUS
+    margin_latitude = np.degrees(radius)
+    margin_longitude = margin_latitude / np.cos(
+        np.radians(min(max(abs(north), abs(south)), 89))
+    )
+    return tiles.points(
+        (
+            north + margin_latitude,
+            south - margin_latitude,
+            west - margin_longitude,
+            east + margin_longitude,
+        )
+    )
 
 
 def _join_pcd_osm(pcd_data: pd.DataFrame, osm_features: pd.DataFrame) -> pd.DataFrame:
-    return pcd_data
+    """Add to each sale the number of points of interest of each OSM key within osm_radius kilometres,
+    as osm_<key> columns, counted for all the sales at once with a tree over the points of interest
+    """
+    tiles = _get_osm_tiles()
+    if tiles is None or "key" not in osm_features.columns:
+        return pcd_data
+
+    radius = config.get("osm_radius", 0.5) / NeighbourIndex.EARTH_RADIUS
+    sales = np.radians(pcd_data[["latitude", "longitude"]].to_numpy("float64"))
+    counts = {}
+    for key in tiles.keys:
+        pois = osm_features.loc[
+            osm_features.key == key, ["latitude", "longitude"]
+        ].to_numpy("float64")
+        if len(pois) == 0 or len(sales) == 0:
+            counts[f"osm_{key}"] = np.zeros(len(sales), dtype="int64")
+            continue
+        tree = sklearn.neighbors.BallTree(np.radians(pois), metric="haversine")
+        counts[f"osm_{key}"] = tree.query_radius(sales, radius, count_only=True)
+    return pcd_data.assign(**counts)
 
 
 def _get_pcd_data(
     data: pd.DataFrame, bounding_box, date_range, property_type
 ) -> pd.DataFrame:
+    if isinstance(data, PreparedDataset):
+        return data.select(bounding_box, date_range, property_type)
+
     north, south, west, east = bounding_box
     date_lb, date_ub = date_range
+    if pd.api.types.is_integer_dtype(data["date_of_transfer"]):
+        date_lb, date_ub = access.epoch_day(date_lb), access.epoch_day(date_ub)
+    else:
+        date_lb, date_ub = pd.Timestamp(date_lb), pd.Timestamp(date_ub)
 
     data_ = data.loc[
         (north > data.latitude)
         & (data.latitude > south)
         & (east > data.longitude)
         & (data.longitude > west)
-        & (pd.Timestamp(date_ub) > data.date_of_transfer)
-        & (data.date_of_transfer > pd.Timestamp(date_lb))
+        & (date_ub > data.date_of_transfer)
+        & (data.date_of_transfer > date_lb)
         & (data.property_type == property_type)
     ]
     return data_
 
 
 def _get_bounding_box(
-    latitude, longitude, data: pd.DataFrame, date_range, property_type
+    latitude, longitude, data: pd.DataFrame, date_range, property_type, stats=None
 ) -> tuple:
-    threshold = 10000
+    # Statistics are only used when given or cached by a PreparedDataset, computing them costs a full scan
+    if stats is None and isinstance(data, PreparedDataset):
+        stats = data.stats
+    threshold, max_box_size = _box_search_limits(
+        latitude, longitude, date_range, property_type, stats
+    )
 
     box_height = 0.01
     box_width = 0.01
@@ -156,7 +513,7 @@ def _get_bounding_box(
     west = longitude - box_width / 2
     east = longitude + box_width / 2
     data_ = _get_pcd_data(data, (north, south, west, east), date_range, property_type)
-    while len(data_.index) < threshold:
+    while len(data_.index) < threshold and box_height < max_box_size:
         box_height *= 2
         box_width *= 2
         north = latitude + box_height / 2
@@ -166,7 +523,1010 @@ def _get_bounding_box(
         data_ = _get_pcd_data(
             data, (north, south, west, east), date_range, property_type
         )
-    return north, south, west, east
+    return _clip_to_globe((north, south, west, east))
+
+
+def _clip_to_globe(bounding_box) -> tuple:
+    """The part of a bounding box on the globe, which a search doubling the box can overshoot"""
+    north, south, west, east = bounding_box
+    return min(north, 90.0), max(south, -90.0), max(west, -180.0), min(east, 180.0)
+
+
+def _box_search_limits(
+    latitude, longitude, date_range, property_type, stats=None
+) -> tuple:
+    """Threshold on the number of sales in the box, and the box size at which to stop growing it.
+    With price statistics (see access.price_stats_from_dataframe) the threshold is capped by the rows available,
+    and the box stops growing once it covers their extent. Without them the box stops once it covers the globe.
+    Raises ValueError when the statistics show no located sales to learn from.
+    """
+    threshold = 10000
+    if stats is None:
+        return threshold, 360.0
+
+    date_lb, date_ub = date_range
+    stats = stats[
+        (stats.property_type == property_type)
+        & (stats.year >= date_lb.year)
+        & (stats.year <= date_ub.year)
+    ]
+    threshold = min(threshold, access.count_from_stats(stats))
+    extents = np.array(
+        [
+            stats.max_latitude.max() - latitude,
+            latitude - stats.min_latitude.min(),
+            stats.max_longitude.max() - longitude,
+            longitude - stats.min_longitude.min(),
+        ],
+        dtype=float,
+    )
+    if threshold == 0 or np.isnan(extents).all():
+        raise ValueError(
+            f"No located sales of property type {property_type} between {date_lb} and {date_ub}"
+        )
+    max_box_size = 2 * max(np.nanmax(extents), 0.01)
+    return threshold, max_box_size
+
+
+def _get_bounding_box_from_db(
+    latitude, longitude, conn, date_range, property_type, source="join", stats=None
+) -> tuple:
+    """_get_bounding_box answered by COUNT queries on the composite indexes of access.index_filter_columns.
+    The limits come from stats, or the maintained `price_stats` table, when there are any. Otherwise the located
+    sales are counted once, with the same inner join as the box counts.
+    """
+    if stats is None and access.table_exists(conn, "price_stats"):
+        stats = access.get_price_stats(conn)
+    if stats is not None and len(stats.index):
+        threshold, max_box_size = _box_search_limits(
+            latitude, longitude, date_range, property_type, stats
+        )
+    else:
+        # A box covering every coordinate, so the count joins like those of the boxes below
+        threshold = min(
+            10000,
+            access.count_prices(
+                conn, (91, -91, -181, 181), date_range, [property_type], source
+            ),
+        )
+        if threshold == 0:
+            raise ValueError(
+                f"No located sales of property type {property_type} in {date_range}"
+            )
+        max_box_size = 360.0
+
+    box_height = 0.01
+    box_width = 0.01
+    north = latitude + box_height / 2
+    south = latitude - box_height / 2
+    west = longitude - box_width / 2
+    east = longitude + box_width / 2
+    count = access.count_prices(
+        conn, (north, south, west, east), date_range, [property_type], source
+    )
+    while count < threshold and box_height < max_box_size:
+        box_height *= 2
+        box_width *= 2
+        north = latitude + box_height / 2
+        south = latitude - box_height / 2
+        west = longitude - box_width / 2
+        east = longitude + box_width / 2
+        count = access.count_prices(
+            conn, (north, south, west, east), date_range, [property_type], source
+        )
+    return _clip_to_globe((north, south, west, east))
+
+
+def _get_bounding_box_indexed(
+    latitude, longitude, data: pd.DataFrame, date_range, property_type, box_index
+) -> tuple:
+    """_get_bounding_box with box counts answered by a BoxCountIndex.
+    The data are only scanned for a box whose lower and upper count bounds straddle the threshold.
+    """
+    threshold = 10000
+
+    box_size = 0.01
+    while True:
+        north = latitude + box_size / 2
+        south = latitude - box_size / 2
+        west = longitude - box_size / 2
+        east = longitude + box_size / 2
+        bounding_box = (north, south, west, east)
+        if box_index.covers(bounding_box):
+            return _clip_to_globe(bounding_box)
+        if box_index.count(bounding_box, date_range, property_type) >= threshold:
+            return _clip_to_globe(bounding_box)
+        if (
+            box_index.count(bounding_box, date_range, property_type, "upper")
+            >= threshold
+        ):
+            data_ = _get_pcd_data(data, bounding_box, date_range, property_type)
+            if len(data_.index) >= threshold:
+                return _clip_to_globe(bounding_box)
+        box_size *= 2
+
+
+def _grid_centre(latitude, longitude, resolution) -> tuple:
+    """The query location rounded to resolution degrees, or unchanged if resolution is 0"""
+    if not resolution:
+        return latitude, longitude
+    return (
+        round(latitude / resolution) * resolution,
+        round(longitude / resolution) * resolution,
+    )
+
+
+class ModelCache:
+    """Least recently used cache of fitted local models, keyed by (property_type, box centre, date range).
+    With a cache, the bounding box is searched around the query location rounded to resolution degrees,
+    so nearby queries of a property type share their bounding box, and the model fitted in it.
+    The key is known before any data is selected, so a hit skips both the bounding box search and the fit.
+    A cache holds the models of one dataset and should not be shared between datasets.
+    """
+
+    def __init__(self, maxsize: int = None, resolution: float = None):
+        """
+        :param maxsize: number of models kept, model_cache_size of the config by default
+        :param resolution: grid in degrees the box centres are rounded to, model_cache_resolution of the config by
+            default; 0 keys the models by the exact query location
+        """
+        if maxsize is None:
+            maxsize = config.get("model_cache_size", 256)
+        if resolution is None:
+            resolution = config.get("model_cache_resolution", 0.005)
+        self.maxsize = maxsize
+        self.resolution = resolution
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def centre(self, latitude, longitude) -> tuple:
+        """Centre of the bounding box search for a query location"""
+        return _grid_centre(latitude, longitude, self.resolution)
+
+    def get(self, key):
+        """The model cached for key, as (reg, score_R2, bounding_box), or None"""
+        fitted = self.models.get(key)
+        if fitted is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.models.move_to_end(key)
+        return fitted
+
+    def put(self, key, fitted) -> None:
+        """Cache a model, evicting the least recently used ones beyond maxsize"""
+        self.models[key] = fitted
+        self.models.move_to_end(key)
+        while len(self.models) > self.maxsize:
+            self.models.popitem(last=False)
+
+    def clear(self) -> None:
+        self.models.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        """Hits, misses, and current and maximum size"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.models),
+            "maxsize": self.maxsize,
+        }
+
+
+def prepare(dataset) -> "PreparedDataset":
+    """The dataset as a PreparedDataset, preparing it unless it already is one"""
+    if isinstance(dataset, PreparedDataset):
+        return dataset
+    return PreparedDataset(dataset)
+
+
+class PreparedDataset:
+    """The labelled dataset, prepared once for any number of predictions.
+    Columns are held as numpy arrays with dates as epoch days and property_type as integer codes.
+    The rows are grouped by property_type and sorted by latitude within each group,
+    so a selection binary-searches its latitude band in one group and only filters the rows of that band.
+    Selections keep the row order and index of the dataset, as _get_pcd_data does.
+    The data frame of the rows, price statistics and the BoxCountIndex are built on first use and kept.
+    The columns can be put in shared memory (share) for other processes to attach without copying (attach).
+    """
+
+    def __init__(self, dataset: pd.DataFrame):
+        """
+        :param dataset: price data with price, latitude, longitude, date_of_transfer and property_type,
+            with dates as strings, datetimes or compact epoch days
+        """
+        data = assess.labelled(dataset)
+        if not pd.api.types.is_integer_dtype(data["date_of_transfer"]):
+            data = data.assign(
+                date_of_transfer=access.to_epoch_days(data["date_of_transfer"])
+            )
+        # Original row positions in sorted order, to give selections back in the row order of the dataset
+        order = (
+            data.reset_index(drop=True)
+            .sort_values(["property_type", "latitude"], kind="stable")
+            .index.to_numpy()
+        )
+        data = data.iloc[order]
+        codes, property_types = pd.factorize(data["property_type"], sort=True)
+
+        self._setup(
+            {
+                "price": data["price"].to_numpy(),
+                "latitude": data["latitude"].to_numpy("float64"),
+                "longitude": data["longitude"].to_numpy("float64"),
+                "date_of_transfer": data["date_of_transfer"].to_numpy("int32"),
+                "property_type": codes.astype("int8"),
+                "order": order.astype("int64"),
+            },
+            list(property_types),
+            data.index.to_numpy(),
+        )
+
+    def _setup(self, columns: dict, property_types: list, index) -> None:
+        self.columns = columns
+        self.property_types = property_types
+        # Index labels of the rows, or None to label them by position in the dataset
+        self._index = index
+        # Rows [start, stop) of each property_type
+        codes = columns["property_type"]
+        starts = np.searchsorted(codes, np.arange(len(property_types)), side="left")
+        stops = np.searchsorted(codes, np.arange(len(property_types)), side="right")
+        self.ranges = {
+            property_type: (int(start), int(stop))
+            for property_type, start, stop in zip(property_types, starts, stops)
+        }
+        self._data = None
+        self._stats = None
+        self._box_index = None
+        self._shared = []
+
+    def __len__(self) -> int:
+        return len(self.columns["price"])
+
+    @property
+    def data(self) -> pd.DataFrame:
+        """The prepared rows as a data frame, grouped by property_type and sorted by latitude.
+        Built on first use and kept, so it should be treated as read-only."""
+        if self._data is None:
+            self._data = self._frame(np.arange(len(self)))
+        return self._data
+
+    def _frame(self, positions: np.ndarray) -> pd.DataFrame:
+        if self._index is None:
+            index = self.columns["order"][positions]
+        else:
+            index = self._index[positions]
+        frame = pd.DataFrame(
+            {
+                name: self.columns[name][positions]
+                for name in ["price", "latitude", "longitude", "date_of_transfer"]
+            },
+            index=index,
+        )
+        frame["property_type"] = pd.Categorical.from_codes(
+            self.columns["property_type"][positions], self.property_types
+        )
+        return frame
+
+    @property
+    def stats(self) -> pd.DataFrame:
+        """Price statistics of the dataset, see access.price_stats_from_dataframe"""
+        if self._stats is None:
+            self._stats = access.price_stats_from_dataframe(self.data)
+        return self._stats
+
+    @property
+    def box_index(self) -> "BoxCountIndex":
+        """BoxCountIndex of the dataset"""
+        if self._box_index is None:
+            self._box_index = BoxCountIndex(self.data)
+        return self._box_index
+
+    def select(self, bounding_box, date_range, property_type) -> pd.DataFrame:
+        """Rows of property_type in bounding_box and date_range, with the exclusive bounds of _get_pcd_data"""
+        north, south, west, east = bounding_box
+        date_lb, date_ub = date_range
+        start, stop = self.ranges.get(property_type, (0, 0))
+        # south < latitude < north
+        latitude = self.columns["latitude"][start:stop]
+        first = start + int(np.searchsorted(latitude, south, side="right"))
+        last = start + int(np.searchsorted(latitude, north, side="left"))
+
+        longitude = self.columns["longitude"][first:last]
+        date = self.columns["date_of_transfer"][first:last]
+        selected = (
+            (east > longitude)
+            & (longitude > west)
+            & (access.epoch_day(date_ub) > date)
+            & (date > access.epoch_day(date_lb))
+        )
+        positions = first + np.flatnonzero(selected)
+        return self._frame(positions[np.argsort(self.columns["order"][positions])])
+
+    def share(self) -> dict:
+        """
+        Move the columns to shared memory, where this dataset keeps using them.
+        :return: the description of the shared columns, for PreparedDataset.attach
+        """
+        if not self._shared:
+            try:
+                for name, column in self.columns.items():
+                    block = shared_memory.SharedMemory(
+                        create=True, size=max(column.nbytes, 1)
+                    )
+                    self._shared.append((name, block))
+                    shared = np.ndarray(column.shape, column.dtype, buffer=block.buf)
+                    shared[:] = column
+                    self.columns[name] = shared
+            except BaseException:
+                # Free the blocks created so far
+                self.unshare()
+                raise
+        return {
+            "columns": {
+                name: (
+                    block.name,
+                    self.columns[name].shape,
+                    self.columns[name].dtype.str,
+                )
+                for name, block in self._shared
+            },
+            "property_types": self.property_types,
+        }
+
+    def unshare(self) -> None:
+        """Move the columns back to private memory and free the shared memory"""
+        for name, block in self._shared:
+            self.columns[name] = self.columns[name].copy()
+            block.close()
+            block.unlink()
+        self._shared = []
+
+    @classmethod
+    def attach(cls, description: dict) -> "PreparedDataset":
+        """A dataset reading in place the columns shared by PreparedDataset.share, e.g. in another process.
+        Its selections are labelled by row position in the original dataset."""
+        dataset = cls.__new__(cls)
+        blocks = []
+        columns = {}
+        for name, (block_name, shape, dtype) in description["columns"].items():
+            block = shared_memory.SharedMemory(name=block_name)
+            columns[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+            blocks.append(block)
+        dataset._setup(columns, description["property_types"], None)
+        # Keep the blocks open while the dataset lives; they are freed by the sharing dataset
+        dataset._attached = blocks
+        return dataset
+
+
+class NeighbourIndex:
+    """Tree indexes over the coordinates of each property_type, to select as the learning dataset the k sales
+    nearest to a location, instead of growing a bounding box until it holds enough sales.
+    A query costs a tree search and the k rows it returns, so the size of the learning dataset, and the time
+    to fit on it, no longer depend on where the location is."""
+
+    # Mean radius of the Earth in kilometres
+    EARTH_RADIUS = 6371.0
+
+    def __init__(
+        self, data, k: int = 10000, metric: str = "haversine", leaf_size: int = 40
+    ):
+        """
+        :param data: data frame or PreparedDataset
+        :param k: number of neighbours selected by default
+        :param metric: "haversine" for great-circle distance, or "euclidean" for distance in easting and northing
+            of an equirectangular projection, which is faster and close to it over a region
+        :param leaf_size: leaf size of the trees
+        """
+        self.dataset = prepare(data)
+        self.k = k
+        self.metric = metric
+        latitude = self.dataset.columns["latitude"]
+        longitude = self.dataset.columns["longitude"]
+        # Latitude at which the euclidean projection keeps scale
+        self.reference_latitude = float(np.nanmean(latitude)) if len(latitude) else 0.0
+
+        # property_type -> tree, and the dataset rows of its points
+        self.trees = {}
+        for property_type, (start, stop) in self.dataset.ranges.items():
+            valid = ~(np.isnan(latitude[start:stop]) | np.isnan(longitude[start:stop]))
+            positions = start + np.flatnonzero(valid)
+            if len(positions) == 0:
+                continue
+            points = self._points(latitude[positions], longitude[positions])
+            if metric == "haversine":
+                tree = sklearn.neighbors.BallTree(
+                    points, leaf_size=leaf_size, metric="haversine"
+                )
+            else:
+                tree = sklearn.neighbors.KDTree(points, leaf_size=leaf_size)
+            self.trees[property_type] = (tree, positions)
+
+    def _points(self, latitude, longitude) -> np.ndarray:
+        """Coordinates of the tree: (latitude, longitude) in radians, or (easting, northing) in kilometres"""
+        latitude = np.radians(np.asarray(latitude, dtype="float64"))
+        longitude = np.radians(np.asarray(longitude, dtype="float64"))
+        if self.metric == "haversine":
+            return np.column_stack([latitude, longitude])
+        scale = np.cos(np.radians(self.reference_latitude))
+        return self.EARTH_RADIUS * np.column_stack([longitude * scale, latitude])
+
+    def query(
+        self, latitude, longitude, property_type, date_range=None, k=None
+    ) -> pd.DataFrame:
+        """
+        Select the k sales of property_type nearest to (latitude, longitude).
+        :param date_range: optional (lower, upper) bounds of date_of_transfer, exclusive as in _get_pcd_data
+        :param k: number of neighbours, the k of the index by default
+        :return: the neighbours, in the row order of the dataset; fewer than k if there are not enough sales
+        """
+        if k is None:
+            k = self.k
+        if property_type not in self.trees:
+            return self.dataset._frame(np.array([], dtype="int64"))
+        tree, positions = self.trees[property_type]
+        dates = self.dataset.columns["date_of_transfer"]
+        point = self._points([latitude], [longitude])
+
+        # Fetch more neighbours until k of them are in the date range
+        fetch = min(k, len(positions))
+        while True:
+            found = positions[tree.query(point, k=fetch)[1][0]]
+            if date_range is not None:
+                date_lb, date_ub = date_range
+                found = found[
+                    (access.epoch_day(date_ub) > dates[found])
+                    & (dates[found] > access.epoch_day(date_lb))
+                ]
+            if len(found) >= k or fetch == len(positions):
+                break
+            fetch = min(2 * fetch, len(positions))
+
+        found = found[:k]
+        return self.dataset._frame(
+            found[np.argsort(self.dataset.columns["order"][found])]
+        )
+
+
+class ParallelPredictor:
+    """Predicts prices for batches of queries across a pool of processes.
+    The prepared columns of the dataset are put in shared memory once, and every worker reads them in place,
+    so the workers start without copying the dataset. Each query is predicted as by predict_price.
+    Use as a context manager, or call close, to stop the workers and free the shared memory.
+    """
+
+    def __init__(self, dataset, processes: int = None):
+        """
+        :param dataset: data frame or PreparedDataset
+        :param processes: number of worker processes, the number of CPUs by default
+        """
+        self.dataset = prepare(dataset)
+        self.processes = processes or os.cpu_count()
+        description = self.dataset.share()
+        try:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                initializer=_attach_prediction_worker,
+                initargs=(description, self.dataset.stats),
+            )
+        except BaseException:
+            self.dataset.unshare()
+            raise
+        # Time spent by each worker, and on each query, see predict
+        self.timings = pd.DataFrame(columns=["worker", "queries", "seconds"])
+        self.latencies = pd.Series(dtype=float)
+
+    def predict(
+        self, queries: pd.DataFrame, chunksize: int = None, earlier_only: bool = False
+    ) -> pd.DataFrame:
+        """
+        Price predictions for a batch of queries, in the order of queries.
+        :param queries: data frame with columns latitude, longitude, date and property_type
+        :param chunksize: number of queries sent to a worker at a time, by default about four chunks per worker
+        :param earlier_only: learn only from the sales before the date of each query, see backtest
+        :return: for each query, the R2 score on the validation dataset, the prediction, and the bounding box,
+            as in predict_prices; the time spent by each worker is left in timings, and on each query in latencies
+        """
+        if chunksize is None:
+            chunksize = max(1, -(-len(queries.index) // (4 * self.processes)))
+        columns = ["latitude", "longitude", "date", "property_type"]
+        results = []
+        timings = []
+        latencies = []
+        try:
+            futures = [
+                self.pool.submit(
+                    _predict_chunk,
+                    queries[columns].iloc[start : start + chunksize],
+                    earlier_only,
+                )
+                for start in range(0, len(queries.index), chunksize)
+            ]
+            for future in futures:
+                result, worker, seconds = future.result()
+                latencies.append(result.pop("seconds"))
+                results.append(result)
+                timings.append((worker, len(result.index), seconds))
+        except BrokenProcessPool:
+            # A worker died, the pool cannot be used again
+            self.close()
+            raise
+        self.latencies = pd.concat(latencies) if latencies else pd.Series(dtype=float)
+        self.timings = (
+            pd.DataFrame(timings, columns=["worker", "queries", "seconds"])
+            .groupby("worker", as_index=False)
+            .sum()
+        )
+        if not results:
+            return _empty_predictions(queries.index)
+        return pd.concat(results)
+
+    def close(self) -> None:
+        """Stop the workers and free the shared memory; closing again does nothing"""
+        try:
+            self.pool.shutdown()
+        finally:
+            self.dataset.unshare()
+
+    def __enter__(self) -> "ParallelPredictor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# State of a ParallelPredictor worker process
+_worker_dataset = None
+_worker_stats = None
+
+
+def _attach_prediction_worker(description: dict, stats: pd.DataFrame) -> None:
+    global _worker_dataset, _worker_stats
+    _worker_dataset = PreparedDataset.attach(description)
+    _worker_stats = stats
+
+
+def _predict_chunk(queries: pd.DataFrame, earlier_only: bool = False) -> tuple:
+    """Predict a chunk of queries in a worker.
+    Returns the results with the time taken by each query, the worker process id, and the time taken.
+    """
+    start_time = time.perf_counter()
+    rows = []
+    for query in queries.itertuples():
+        query_time = time.perf_counter()
+        if earlier_only:
+            score_R2, y_pred, bounding_box = _predict_before(
+                _worker_dataset,
+                query.latitude,
+                query.longitude,
+                query.date,
+                query.property_type,
+                _worker_stats,
+            )
+        else:
+            score_R2, y_pred, bounding_box = predict_price(
+                _worker_dataset,
+                query.latitude,
+                query.longitude,
+                query.date,
+                query.property_type,
+                _worker_stats,
+            )
+        rows.append(
+            (score_R2, y_pred[0], *bounding_box, time.perf_counter() - query_time)
+        )
+    result = pd.DataFrame(
+        rows,
+        columns=["r2", "prediction", "north", "south", "west", "east", "seconds"],
+        index=queries.index,
+    )
+    return result, os.getpid(), time.perf_counter() - start_time
+
+
+def _predict_before(
+    dataset, latitude, longitude, date, property_type, stats=None
+) -> tuple[float, list, tuple]:
+    """predict_price learning only from the sales before date, so a sale of the dataset can be held out"""
+    date_lb, _ = _get_date_range(date)
+    date_range = (date_lb, pd.Timestamp(date).date())
+    try:
+        bounding_box = _get_bounding_box(
+            latitude, longitude, dataset, date_range, property_type, stats
+        )
+    except ValueError:
+        # No earlier located sales of the property type at all
+        return np.nan, np.array([np.nan]), (np.nan,) * 4
+    train_set = _select_learning_dataset(
+        dataset, bounding_box, date_range, property_type
+    )
+    # Too few earlier sales to fit and validate a model
+    if len(train_set.index) < 5:
+        return np.nan, np.array([np.nan]), bounding_box
+    reg, score_R2 = _fit_local_model(train_set)
+    x_pred_design = _prediction_design(
+        [latitude], [longitude], [date], bounding_box, property_type
+    )
+    return score_R2, reg.predict(x_pred_design[reg.feature_names_in_]), bounding_box
+
+
+def backtest(
+    dataset: pd.DataFrame,
+    n: int = 1000,
+    region: str = "county",
+    processes: int = None,
+    seed: int = 0,
+    start_date: datetime.date = datetime.date(2000, 1, 1),
+) -> tuple[pd.DataFrame, pd.DataFrame, dict]:
+    """
+    Back-test the price predictions on sales held out of the dataset, each predicted from the earlier sales only,
+    across a ParallelPredictor.
+    :param dataset: price data, with the region column if there is one
+    :param n: number of sales held out
+    :param region: column to report the accuracy by, e.g. county or district; ignored if not in the dataset
+    :param processes: number of worker processes, the number of CPUs by default
+    :param seed: seed of the sample of held out sales
+    :param start_date: sales are held out from this date on, to leave earlier sales to learn from
+    :return: the held out sales with their predictions and latencies;
+        the R2, MAE and MAPE of the predictions by region and property_type, with an "all" row;
+        the throughput in queries per second and the p50, p95 and p99 latencies in seconds
+    """
+    dates = access.parse_dates(dataset["date_of_transfer"])
+    candidates = dataset.index[
+        (dates >= pd.Timestamp(start_date)).to_numpy()
+        & dataset.latitude.notna().to_numpy()
+        & dataset.longitude.notna().to_numpy()
+    ]
+    held_out = np.random.default_rng(seed).choice(
+        len(candidates), size=min(n, len(candidates)), replace=False
+    )
+    sales = pd.DataFrame(
+        {
+            "latitude": dataset.loc[candidates[held_out], "latitude"].astype(float),
+            "longitude": dataset.loc[candidates[held_out], "longitude"].astype(float),
+            "date": dates.loc[candidates[held_out]],
+            "property_type": dataset.loc[candidates[held_out], "property_type"].astype(
+                str
+            ),
+            "price": dataset.loc[candidates[held_out], "price"].astype(float),
+            "region": (
+                dataset.loc[candidates[held_out], region].astype(str)
+                if region in dataset.columns
+                else "all"
+            ),
+        }
+    )
+
+    with ParallelPredictor(dataset, processes) as predictor:
+        start_time = time.perf_counter()
+        predictions = predictor.predict(sales, earlier_only=True)
+        seconds = time.perf_counter() - start_time
+        sales = sales.assign(
+            prediction=predictions["prediction"],
+            r2=predictions["r2"],
+            seconds=predictor.latencies,
+        )
+
+    predicted = sales[sales.prediction.notna()]
+    # Iterating the groups works on every pandas version, unlike apply without the grouping columns
+    by_group = [
+        (key, _accuracy(group))
+        for key, group in predicted.groupby(["region", "property_type"])
+    ]
+    by_group.append((("all", "all"), _accuracy(predicted)))
+    accuracy = pd.DataFrame(
+        [row for _, row in by_group],
+        index=pd.MultiIndex.from_tuples(
+            [key for key, _ in by_group], names=["region", "property_type"]
+        ),
+    )
+    performance = {
+        "queries": len(sales.index),
+        "seconds": seconds,
+        "queries_per_second": len(sales.index) / seconds if seconds > 0 else np.nan,
+        "p50": sales.seconds.quantile(0.5),
+        "p95": sales.seconds.quantile(0.95),
+        "p99": sales.seconds.quantile(0.99),
+    }
+    return sales, accuracy, performance
+
+
+def _accuracy(sales: pd.DataFrame) -> pd.Series:
+    """R2, mean absolute error and mean absolute percentage error of the predictions of sales"""
+    error = sales.prediction - sales.price
+    variance = ((sales.price - sales.price.mean()) ** 2).sum()
+    return pd.Series(
+        {
+            "count": len(sales.index),
+            "r2": 1 - (error**2).sum() / variance if variance > 0 else np.nan,
+            "mae": error.abs().mean(),
+            "mape": (error.abs() / sales.price).mean(),
+        }
+    )
+
+
+class BoxCountIndex:
+    """Summed-area tables of sale counts over a (year, latitude, longitude) grid, one per property_type.
+    count answers how many sales of a type fall in a bounding box and date range with eight lookups,
+    whatever the size of the dataset."""
+
+    def __init__(self, data: pd.DataFrame, cell_size: float = 0.02):
+        """
+        :param data: dataset with latitude, longitude, date_of_transfer and property_type
+        :param cell_size: grid cell size in degrees
+        """
+        valid = data.latitude.notna() & data.longitude.notna()
+        latitude = data.latitude[valid].to_numpy("float64")
+        longitude = data.longitude[valid].to_numpy("float64")
+        years = _years(data.date_of_transfer[valid])
+        property_types = data.property_type[valid].to_numpy()
+
+        self.cell_size = cell_size
+        self.south = np.floor(latitude.min() / cell_size) * cell_size
+        self.west = np.floor(longitude.min() / cell_size) * cell_size
+        self.first_year = int(years.min())
+        rows = ((latitude - self.south) / cell_size).astype("int64")
+        columns = ((longitude - self.west) / cell_size).astype("int64")
+        periods = years - self.first_year
+        self.shape = tuple(
+            int(n) + 1 for n in (periods.max(), rows.max(), columns.max())
+        )
+        self.north = self.south + self.shape[1] * cell_size
+        self.east = self.west + self.shape[2] * cell_size
+
+        cells = np.ravel_multi_index((periods, rows, columns), self.shape)
+        self.tables = {}
+        for property_type in np.unique(property_types):
+            selected = property_types == property_type
+            counts = np.bincount(cells[selected], minlength=np.prod(self.shape))
+            table = np.zeros(tuple(n + 1 for n in self.shape), dtype="int64")
+            table[1:, 1:, 1:] = counts.reshape(self.shape).cumsum(0).cumsum(1).cumsum(2)
+            self.tables[property_type] = table
+
+    def covers(self, bounding_box) -> bool:
+        """Whether the box contains the whole grid"""
+        north, south, west, east = bounding_box
+        return (
+            north > self.north
+            and south < self.south
+            and west < self.west
+            and east > self.east
+        )
+
+    def count(self, bounding_box, date_range, property_type, bound="lower") -> int:
+        """
+        Count sales of property_type in bounding_box and date_range from the grid.
+        :param bounding_box: (north, south, west, east)
+        :param date_range: (lower, upper) bounds of date_of_transfer, exclusive as in _get_pcd_data
+        :param property_type: property type code
+        :param bound: "lower" counts only whole cells and years inside the query, "upper" every cell and year
+            touching it, so the exact count is between the two
+        """
+        table = self.tables.get(property_type)
+        if table is None:
+            return 0
+        north, south, west, east = bounding_box
+        date_lb, date_ub = date_range
+        inner = bound == "lower"
+
+        if inner:
+            periods = (date_lb.year + 1, date_ub.year)
+        else:
+            periods = (date_lb.year, date_ub.year + 1)
+        t0, t1 = np.clip(np.array(periods) - self.first_year, 0, self.shape[0])
+        i0, i1 = self._cells(south, north, self.south, self.shape[1], inner)
+        j0, j1 = self._cells(west, east, self.west, self.shape[2], inner)
+        if t0 >= t1 or i0 >= i1 or j0 >= j1:
+            return 0
+
+        # Inclusion-exclusion over the eight corners of the summed-area table
+        total = 0
+        for t, t_sign in ((t1, 1), (t0, -1)):
+            for i, i_sign in ((i1, 1), (i0, -1)):
+                for j, j_sign in ((j1, 1), (j0, -1)):
+                    total += t_sign * i_sign * j_sign * table[t, i, j]
+        return int(total)
+
+    def _cells(self, low, high, origin, n, inner) -> tuple:
+        """Range [first, last) of grid cells inside (inner) or touching the interval (low, high)"""
+        start = (low - origin) / self.cell_size
+        stop = (high - origin) / self.cell_size
+        if inner:
+            first, last = np.ceil(start), np.floor(stop)
+        else:
+            first, last = np.floor(start), np.floor(stop) + 1
+        return int(np.clip(first, 0, n)), int(np.clip(last, 0, n))
+
+
+class RegressionGrid:
+    """Sufficient statistics of the least squares fit of _fit_local_model, per property_type, over
+    (year, latitude, longitude) cells at several resolutions.
+    Each cell holds the row count and the sums of x x^T and x y for x = (1, latitude, longitude, date_of_transfer),
+    and of y^2 for y = price, so the fit over a bounding box is a sum over the cells it covers
+    and a solve of the 4x4 normal equations, whatever the number of rows.
+    A box covers the cells whose centre is inside it, and the years of its date range.
+    """
+
+    # Sums kept per cell: the upper triangle of x x^T, x y, and y^2
+    _PAIRS = [(i, j) for i in range(4) for j in range(i, 4)]
+
+    def __init__(
+        self,
+        data: pd.DataFrame = None,
+        resolutions: tuple = (0.005, 0.02, 0.08),
+        max_cells: int = 64,
+    ):
+        """
+        :param data: dataset with price, latitude, longitude, date_of_transfer and property_type,
+            or a PreparedDataset; the grid starts empty if None
+        :param resolutions: cell sizes in degrees
+        :param max_cells: a box is summed at the finest resolution it spans at most max_cells cells of
+        """
+        self.resolutions = tuple(sorted(resolutions))
+        self.max_cells = max_cells
+        # Offsets of latitude, longitude and date, to keep the sums well conditioned
+        self.origin = None
+        # (property_type, resolution) -> sorted cell keys, and the running sums of their statistics
+        self.cells = {}
+        self.sums = {}
+        if data is not None:
+            self.add(data)
+
+    def add(self, data: pd.DataFrame) -> None:
+        """Add the statistics of new sales, e.g. from an ingested update"""
+        self._update(data, 1)
+
+    def remove(self, data: pd.DataFrame) -> None:
+        """Remove the statistics of sales, e.g. deleted or changed by an update"""
+        self._update(data, -1)
+
+    def _update(self, data, sign) -> None:
+        if isinstance(data, PreparedDataset):
+            data = data.data
+        data = data[data.latitude.notna() & data.longitude.notna()]
+        if len(data.index) == 0:
+            return
+        dates = data["date_of_transfer"]
+        if not pd.api.types.is_integer_dtype(dates):
+            dates = access.to_epoch_days(dates)
+        dates = dates.to_numpy("float64")
+        latitude = data.latitude.to_numpy("float64")
+        longitude = data.longitude.to_numpy("float64")
+        if self.origin is None:
+            self.origin = (latitude.mean(), longitude.mean(), dates.mean())
+
+        x = np.column_stack(
+            [
+                np.ones(len(latitude)),
+                latitude - self.origin[0],
+                longitude - self.origin[1],
+                dates - self.origin[2],
+            ]
+        )
+        y = data.price.to_numpy("float64")
+        statistics = sign * np.column_stack(
+            [x[:, i] * x[:, j] for i, j in self._PAIRS]
+            + [x[:, i] * y for i in range(4)]
+            + [y * y]
+        )
+        years = _years(data.date_of_transfer)
+        property_types = data.property_type.to_numpy()
+
+        for resolution in self.resolutions:
+            keys = self._keys(years, latitude, longitude, resolution)
+            for property_type in np.unique(property_types):
+                selected = property_types == property_type
+                cell_sums = (
+                    pd.DataFrame(statistics[selected]).groupby(keys[selected]).sum()
+                )
+                old_keys = self.cells.get((property_type, resolution))
+                if old_keys is not None:
+                    # Back from running sums to the sums of each cell, to merge in the new ones
+                    old_sums = pd.DataFrame(
+                        np.diff(self.sums[(property_type, resolution)], axis=0),
+                        index=old_keys,
+                    )
+                    cell_sums = cell_sums.add(old_sums, fill_value=0)
+                self.cells[(property_type, resolution)] = cell_sums.index.to_numpy(
+                    "int64"
+                )
+                running = np.zeros((len(cell_sums.index) + 1, statistics.shape[1]))
+                running[1:] = cell_sums.to_numpy().cumsum(axis=0)
+                self.sums[(property_type, resolution)] = running
+
+    @staticmethod
+    def _keys(years, latitude, longitude, resolution) -> np.ndarray:
+        """Cell keys, ordered by year, then latitude row, then longitude column"""
+        rows = np.floor((np.asarray(latitude) + 90) / resolution).astype("int64")
+        columns = np.floor((np.asarray(longitude) + 180) / resolution).astype("int64")
+        n_columns = int(np.ceil(360 / resolution)) + 1
+        n_rows = int(np.ceil(180 / resolution)) + 1
+        return (np.asarray(years, dtype="int64") * n_rows + rows) * n_columns + columns
+
+    def statistics(self, bounding_box, date_range, property_type) -> np.ndarray:
+        """Sums of the statistics over the cells covered by the box and the years of the date range"""
+        north, south, west, east = bounding_box
+        date_lb, date_ub = date_range
+        size = max(north - south, east - west)
+        resolution = next(
+            (r for r in self.resolutions if size / r <= self.max_cells),
+            self.resolutions[-1],
+        )
+        statistics = len(self._PAIRS) + 5
+        keys = self.cells.get((property_type, resolution))
+        if keys is None:
+            return np.zeros(statistics)
+        running = self.sums[(property_type, resolution)]
+
+        # Rows and columns of the cells whose centre is in the box
+        first_row, last_row = np.round(
+            (np.array([south, north]) + 90) / resolution
+        ).astype("int64")
+        first_column, last_column = np.round(
+            (np.array([west, east]) + 180) / resolution
+        ).astype("int64")
+        if first_row >= last_row or first_column >= last_column:
+            return np.zeros(statistics)
+        years = np.arange(date_lb.year, date_ub.year + 1)
+        rows = np.arange(first_row, last_row)
+        years, rows = [a.ravel() for a in np.meshgrid(years, rows, indexing="ij")]
+
+        # One band of consecutive keys per (year, row)
+        n_columns = int(np.ceil(360 / resolution)) + 1
+        n_rows = int(np.ceil(180 / resolution)) + 1
+        band = (years * n_rows + rows) * n_columns
+        starts = np.searchsorted(keys, band + first_column)
+        stops = np.searchsorted(keys, band + last_column)
+        return (running[stops] - running[starts]).sum(axis=0)
+
+    def count(self, bounding_box, date_range, property_type) -> int:
+        """Number of sales in the cells covered by the box"""
+        return int(round(self.statistics(bounding_box, date_range, property_type)[0]))
+
+    def fit(self, bounding_box, date_range, property_type) -> tuple:
+        """
+        Fit the linear model of _fit_local_model to the sales in the cells covered by the box.
+        :return: the fitted LinearRegression and its R2 score, which is over all the covered sales rather than a
+            validation split; (None, nan) if there are too few sales
+        """
+        sums = self.statistics(bounding_box, date_range, property_type)
+        n = sums[0]
+        if n < 4:
+            return None, np.nan
+        xx = np.zeros((4, 4))
+        for k, (i, j) in enumerate(self._PAIRS):
+            xx[i, j] = xx[j, i] = sums[k]
+        xy = sums[len(self._PAIRS) : len(self._PAIRS) + 4]
+        yy = sums[-1]
+
+        # The normal equations, centred on the means, for the slopes; then the intercept
+        mean_x = xx[0, 1:] / n
+        mean_y = xy[0] / n
+        covariance = xx[1:, 1:] / n - np.outer(mean_x, mean_x)
+        cross = xy[1:] / n - mean_x * mean_y
+        slopes = np.linalg.lstsq(covariance, cross, rcond=None)[0]
+        variance = yy / n - mean_y**2
+        residual = variance - 2 * slopes @ cross + slopes @ covariance @ slopes
+        score_R2 = 1 - residual / variance if variance > 0 else np.nan
+
+        reg = sklearn.linear_model.LinearRegression()
+        reg.coef_ = slopes
+        reg.intercept_ = mean_y - mean_x @ slopes - np.array(self.origin) @ slopes
+        reg.n_features_in_ = 3
+        reg.feature_names_in_ = np.array(
+            ["latitude", "longitude", "date_of_transfer"], dtype=object
+        )
+        return reg, score_R2
+
+
+def _years(dates: pd.Series) -> np.ndarray:
+    """Years of date_of_transfer, given as datetimes or compact epoch days"""
+    return access.parse_dates(dates).dt.year.to_numpy("int64")
 
 
 def _get_date_range(date: datetime.date) -> tuple[datetime.date, datetime.date]:
@@ -1,11 +1,11 @@
+import os
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import date
 from pprint import pprint
 
-import matplotlib
-import mlai.plot as plot
-import osmnx as ox
+import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
 
 from . import access
 
@@ -26,29 +26,57 @@ time-zoned. """
 def data(df: pd.DataFrame) -> pd.DataFrame:
     """Load the data from access and ensure missing values are correctly encoded as well as indices correct,
     column names informative, date and times correctly formatted. Return a structured data structure such as a data
-    frame."""
-    df.loc[:, "date_of_transfer"] = pd.to_datetime(df["date_of_transfer"])
+    frame.
+    Dates already in the compact epoch-day form of access.to_compact are kept as they are.
+    Each distinct date string is parsed once, see access.parse_dates.
+    """
+    if not pd.api.types.is_integer_dtype(df["date_of_transfer"]):
+        df["date_of_transfer"] = access.parse_dates(df["date_of_transfer"])
     return df
 
 
-def query(conn, sql_command: str) -> tuple:
-    """Request user input for some aspect of the data."""
+def query(conn, sql_command: str, chunksize: int = None):
+    """Request user input for some aspect of the data.
+    If chunksize is given, return an iterator of data frame chunks read through a server-side cursor.
+    """
     # conn = access.create_connection(username, password, url, "property_prices", port)
+    if chunksize is not None:
+        return access.iter_query(conn, sql_command, chunksize=chunksize)
     cur = conn.cursor()
     cur.execute(sql_command)
     rows = cur.fetchall()
     return rows
 
 
-def plot_date_view(dataset: pd.DataFrame):
-    """Plot a diagram of house prices in London across date_of_transfer"""
+def plot_date_view(
+    dataset: pd.DataFrame,
+    bounding_box: tuple = (52, 51, -0.5, 0.5),
+    freq: str = "month",
+    quantiles: tuple = (0.1, 0.25, 0.75, 0.9),
+):
+    """Plot a diagram of house prices in London across date_of_transfer
+    :param bounding_box: (north, south, west, east) of the sales shown
+    :param freq: "month" or "week" to draw the median and quantile bands of the prices of each period,
+        from price_series, or None to scatter every sale
+    :param quantiles: two or four quantiles bounding the bands, from the outermost
+    """
+    if freq is not None:
+        _plot_price_series(
+            price_series(dataset, bounding_box, freq, quantiles), quantiles
+        )
+        return
+
+    # The plotting stack is imported on first use rather than with fynesse
+    from matplotlib import pyplot as plt
+
+    north, south, west, east = bounding_box
     data_: pd.DataFrame = dataset.loc[
-        (52 > dataset.latitude)
-        & (dataset.latitude > 51)
-        & (0.5 > dataset.longitude)
-        & (dataset.longitude > -0.5)
+        (north > dataset.latitude)
+        & (dataset.latitude > south)
+        & (east > dataset.longitude)
+        & (dataset.longitude > west)
     ]
-    data_.loc[:, "date_of_transfer"] = pd.to_datetime(data_["date_of_transfer"])
+    data_ = data_.assign(date_of_transfer=access.parse_dates(data_["date_of_transfer"]))
 
     flat = data_[data_.property_type == "F"]
     semidetached = data_[data_.property_type == "S"]
@@ -104,24 +132,32 @@ def plot_date_view(dataset: pd.DataFrame):
     plt.show()
 
 
-def plot_loc_view(dataset: pd.DataFrame):
-    """Plot a map of house prices in London w.r.t. latitude & longitude"""
-    north = 52
-    south = 51
-    west = -0.7
-    east = 0.3
+def plot_loc_view(
+    dataset: pd.DataFrame,
+    bounding_box: tuple = (52, 51, -0.7, 0.3),
+    years: tuple = (2022, 2022),
+    binned: bool = False,
+    bins: int = 200,
+    statistic: str = "median",
+    hexbin: bool = False,
+):
+    """Plot a map of house prices in London w.r.t. latitude & longitude
+    :param bounding_box: (north, south, west, east) of the map
+    :param years: first and last year of the sales shown
+    :param binned: draw, for each property_type, a grid of cells coloured by the statistic of the log prices of their
+        sales instead of every sale, so drawing takes the same time for a town or the whole country
+    :param bins: number of cells along each side of the grid
+    :param statistic: "median" or "mean" of the log prices of a cell
+    :param hexbin: bin into hexagons rather than squares
+    """
+    north, south, west, east = bounding_box
+    data_ = _select_view(dataset, bounding_box, years)
+    if binned:
+        _plot_binned_loc_view(data_, bounding_box, bins, statistic, hexbin)
+        return
 
-    data_: pd.DataFrame = dataset.loc[
-        (north > dataset.latitude)
-        & (dataset.latitude > south)
-        & (east > dataset.longitude)
-        & (dataset.longitude > west)
-    ]
-    data_.loc[:, "date_of_transfer"] = pd.to_datetime(data_["date_of_transfer"])
-    data_ = data_.loc[
-        (pd.Timestamp(date(2022, 12, 31)) > data_.date_of_transfer)
-        & (data_.date_of_transfer > pd.Timestamp(date(2022, 1, 1)))
-    ]
+    import matplotlib
+    from matplotlib import pyplot as plt
 
     flat = data_[data_.property_type == "F"]
     semidetached = data_[data_.property_type == "S"]
@@ -187,6 +223,750 @@ def plot_loc_view(dataset: pd.DataFrame):
     plt.show()
 
 
+def _select_view(
+    dataset: pd.DataFrame, bounding_box: tuple, years: tuple
+) -> pd.DataFrame:
+    """Sales in the bounding box and strictly between the first day of the first year and the last day of the last,
+    comparing compact epoch-day dates without converting them"""
+    north, south, west, east = bounding_box
+    data_: pd.DataFrame = dataset.loc[
+        (north > dataset.latitude)
+        & (dataset.latitude > south)
+        & (east > dataset.longitude)
+        & (dataset.longitude > west)
+    ]
+    first, last = years
+    dates = data_["date_of_transfer"]
+    if pd.api.types.is_integer_dtype(dates):
+        date_lb = access.epoch_day(date(first, 1, 1))
+        date_ub = access.epoch_day(date(last, 12, 31))
+    else:
+        dates = access.parse_dates(dates)
+        date_lb = pd.Timestamp(date(first, 1, 1))
+        date_ub = pd.Timestamp(date(last, 12, 31))
+    return data_.loc[(date_ub > dates) & (dates > date_lb)]
+
+
+PROPERTY_TYPES = {
+    "F": "Flat",
+    "D": "Detached",
+    "S": "Semidetached",
+    "T": "Terraced",
+    "O": "Other",
+}
+
+
+def binned_prices(
+    dataset: pd.DataFrame,
+    bounding_box: tuple,
+    bins: int = 200,
+    statistic: str = "median",
+) -> np.ndarray:
+    """
+    Bin sales into a latitude x longitude grid per property_type in one vectorised pass
+    :param bounding_box: (north, south, west, east) covered by the grid
+    :param bins: number of cells along each side
+    :param statistic: "median" or "mean" of the log prices of a cell
+    :return: array of the statistic, indexed by the property types of PROPERTY_TYPES, the row from south to north,
+        and the column from west to east; nan for cells without sales
+    """
+    north, south, west, east = bounding_box
+    codes = pd.Categorical(
+        dataset["property_type"], categories=list(PROPERTY_TYPES)
+    ).codes.astype("int64")
+    rows = (
+        (dataset["latitude"].to_numpy("float64") - south) / (north - south) * bins
+    ).astype("int64")
+    columns = (
+        (dataset["longitude"].to_numpy("float64") - west) / (east - west) * bins
+    ).astype("int64")
+    log_prices = np.log(dataset["price"].to_numpy("float64"))
+    valid = (
+        (codes >= 0) & (rows >= 0) & (rows < bins) & (columns >= 0) & (columns < bins)
+    )
+    cells = (codes[valid] * bins + rows[valid]) * bins + columns[valid]
+    log_prices = log_prices[valid]
+
+    n_cells = len(PROPERTY_TYPES) * bins * bins
+    counts = np.bincount(cells, minlength=n_cells)
+    result = np.full(n_cells, np.nan)
+    filled = counts > 0
+    if statistic == "mean":
+        sums = np.bincount(cells, weights=log_prices, minlength=n_cells)
+        result[filled] = sums[filled] / counts[filled]
+    elif statistic == "median":
+        # Sort by cell then log price; the median of a cell is in the middle of its run
+        order = np.lexsort((log_prices, cells))
+        ordered = log_prices[order]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        lower = starts + (counts - 1) // 2
+        upper = starts + counts // 2
+        result[filled] = (ordered[lower[filled]] + ordered[upper[filled]]) / 2
+    else:
+        raise ValueError(f"Unknown statistic {statistic}, expected median or mean")
+    return result.reshape(len(PROPERTY_TYPES), bins, bins)
+
+
+def _plot_binned_loc_view(
+    data_: pd.DataFrame, bounding_box: tuple, bins: int, statistic: str, hexbin: bool
+):
+    from matplotlib import pyplot as plt
+
+    north, south, west, east = bounding_box
+    fig, axes = plt.subplots(1, len(PROPERTY_TYPES), sharey=True, figsize=(20, 5))
+    if hexbin:
+        reduce = np.median if statistic == "median" else np.mean
+        log_prices = np.log(data_["price"].to_numpy("float64"))
+        codes = pd.Categorical(
+            data_["property_type"], categories=list(PROPERTY_TYPES)
+        ).codes
+        vmin, vmax = (
+            (np.nanmin(log_prices), np.nanmax(log_prices))
+            if len(log_prices)
+            else (0, 1)
+        )
+        for i, ax in enumerate(axes):
+            selected = codes == i
+            image = ax.hexbin(
+                data_["longitude"].to_numpy("float64")[selected],
+                data_["latitude"].to_numpy("float64")[selected],
+                C=log_prices[selected],
+                reduce_C_function=reduce,
+                gridsize=bins,
+                extent=(west, east, south, north),
+                vmin=vmin,
+                vmax=vmax,
+                cmap="viridis",
+            )
+    else:
+        grids = binned_prices(data_, bounding_box, bins, statistic)
+        vmin, vmax = (
+            (np.nanmin(grids), np.nanmax(grids)) if np.isfinite(grids).any() else (0, 1)
+        )
+        for i, ax in enumerate(axes):
+            image = ax.imshow(
+                grids[i],
+                origin="lower",
+                extent=(west, east, south, north),
+                aspect="auto",
+                vmin=vmin,
+                vmax=vmax,
+                cmap="viridis",
+                interpolation="nearest",
+            )
+
+    for ax, name in zip(axes, PROPERTY_TYPES.values()):
+        ax.set_xlim([west, east])
+        ax.set_ylim([south, north])
+        ax.set_xlabel("longitude")
+        ax.set_title(name)
+    axes[0].set_ylabel("latitude")
+    fig.colorbar(image, ax=axes, label=f"{statistic} log price")
+    plt.show()
+
+
+PROPERTY_TYPE_COLORS = {
+    "F": "red",
+    "D": "green",
+    "S": "blue",
+    "T": "purple",
+    "O": "grey",
+}
+
+# Aggregates of price_series, by id of the dataset
+_price_series_cache = {}
+
+
+def price_series(
+    dataset: pd.DataFrame,
+    bounding_box: tuple = None,
+    freq: str = "month",
+    quantiles: tuple = (0.1, 0.25, 0.75, 0.9),
+    cache: bool = True,
+) -> pd.DataFrame:
+    """
+    Aggregate prices by property_type and month or week in one grouped pass
+    :param bounding_box: optional (north, south, west, east) of the sales aggregated
+    :param freq: "month" or "week" (starting on Monday)
+    :param quantiles: quantiles of the prices computed besides the median
+    :param cache: reuse the aggregate computed for the same dataset object and arguments;
+        pass False after changing the dataset in place
+    :return: data frame indexed by property_type and period start, with count, median and the quantile columns
+    """
+    key = (id(dataset), bounding_box, freq, tuple(quantiles))
+    cached = _price_series_cache.get(key)
+    if cache and cached is not None and cached[0]() is dataset:
+        return cached[1]
+
+    data_ = dataset
+    if bounding_box is not None:
+        north, south, west, east = bounding_box
+        data_ = dataset.loc[
+            (north > dataset.latitude)
+            & (dataset.latitude > south)
+            & (east > dataset.longitude)
+            & (dataset.longitude > west)
+        ]
+    dates = data_["date_of_transfer"]
+    days = access.to_epoch_days(dates).to_numpy("int64").astype("datetime64[D]")
+    if freq == "month":
+        periods = days.astype("datetime64[M]").astype("datetime64[D]")
+    elif freq == "week":
+        # 1970-01-01 was a Thursday
+        periods = ((days.astype("int64") + 3) // 7 * 7 - 3).astype("datetime64[D]")
+    else:
+        raise ValueError(f"Unknown freq {freq}, expected month or week")
+
+    grouped = (
+        data_["price"]
+        .astype("float64")
+        .groupby([data_["property_type"].astype(str).to_numpy(), periods])
+    )
+    series = grouped.quantile([0.5, *quantiles]).unstack()
+    series.columns = ["median", *(f"q{q:g}" for q in quantiles)]
+    series.insert(0, "count", grouped.size())
+    series.index = series.index.set_names(["property_type", "period"])
+    series.index = series.index.set_levels(
+        pd.to_datetime(series.index.levels[1]), level=1
+    )
+
+    # Drop the aggregates of datasets that no longer exist
+    for stale in [k for k, (ref, _) in _price_series_cache.items() if ref() is None]:
+        del _price_series_cache[stale]
+    _price_series_cache[key] = (weakref.ref(dataset), series)
+    return series
+
+
+def _plot_price_series(series: pd.DataFrame, quantiles: tuple):
+    from matplotlib import pyplot as plt
+
+    bands = [f"q{q:g}" for q in quantiles]
+    fig, axes = plt.subplots(1, len(PROPERTY_TYPES), sharey=True, figsize=(10, 5))
+    for ax, (property_type, name) in zip(axes, PROPERTY_TYPES.items()):
+        ax.set_xlabel("date")
+        ax.set_ylabel("price")
+        ax.set_yscale("log")
+        ax.set_title(name)
+        if property_type not in series.index.get_level_values("property_type"):
+            continue
+        typed = series.loc[property_type]
+        color = PROPERTY_TYPE_COLORS[property_type]
+        # From the outermost band in
+        for i in range(len(bands) // 2):
+            ax.fill_between(
+                typed.index,
+                typed[bands[i]],
+                typed[bands[-1 - i]],
+                color=color,
+                alpha=0.15 * (i + 1),
+                linewidth=0,
+            )
+        ax.plot(typed.index, typed["median"], color=color, linewidth=1)
+        ax.tick_params(labelrotation=45)
+    plt.tight_layout()
+    plt.show()
+
+
+# Levels of PriceCube, with the `postcode_data` columns naming their regions
+CUBE_LEVELS = {
+    "area": "postcode_area",
+    "district": "postcode_district",
+    "sector": "postcode_sector",
+}
+
+
+class PriceCube:
+    """
+    Count, mean, centred sum of squares and log-price histogram of the sales of each postcode area, district and
+    sector, month and property_type, built in one pass and updated incrementally, so that regional summaries are
+    lookups. Means and centred sums of squares are merged pairwise (Chan et al.), which keeps the variance accurate
+    where the sums of squares of prices would cancel.
+    """
+
+    def __init__(
+        self, regions: pd.DataFrame, bins: int = 64, log_price_range: tuple = (3, 8)
+    ):
+        """
+        :param regions: area, district, sector and coordinates of each postcode, from access.load_postcode_regions
+        :param bins: number of histogram bins of log10 price, the resolution of the approximate quantiles
+        :param log_price_range: log10 prices spanned by the bins, prices outside fall in the end bins
+        """
+        self.regions = regions
+        self.bins = bins
+        self.edges = np.linspace(*log_price_range, bins + 1)
+        # Tree over the located postcodes and their rows in regions, built by locate on first use
+        self._tree = None
+        self._located = None
+        empty = self._aggregate(
+            pd.DataFrame(
+                columns=["price", "date_of_transfer", "postcode", "property_type"]
+            )
+        )
+        self.cells = {level: cells for level, (cells, _) in empty.items()}
+        self.histograms = {level: histogram for level, (_, histogram) in empty.items()}
+
+    @classmethod
+    def build(cls, chunks, regions: pd.DataFrame, **kwargs) -> "PriceCube":
+        """
+        Build the cube in one pass over the sales
+        :param chunks: a data frame of sales, or data frame chunks of them, e.g. from access.iter_join_pp_pc,
+            with price, date_of_transfer, postcode and property_type columns
+        :param regions: as for PriceCube
+        """
+        cube = cls(regions, **kwargs)
+        if isinstance(chunks, pd.DataFrame):
+            chunks = [chunks]
+        parts = []
+        for chunk in chunks:
+            parts.append(cube._aggregate(chunk))
+            # Merge now and then, so the partial aggregates held stay small
+            if len(parts) == 16:
+                cube._merge(parts, 1)
+                parts = []
+        cube._merge(parts, 1)
+        return cube
+
+    def add(self, sales: pd.DataFrame) -> None:
+        """Add sales, e.g. those of a newly loaded file, with the columns of build"""
+        self._merge([self._aggregate(sales)], 1)
+
+    def remove(self, sales: pd.DataFrame) -> None:
+        """Remove sales added before, e.g. deleted or changed records"""
+        self._merge([self._aggregate(sales)], -1)
+
+    def _aggregate(self, sales: pd.DataFrame) -> dict:
+        located = sales.join(
+            self.regions[list(CUBE_LEVELS.values())], on="postcode", how="inner"
+        )
+        prices = located["price"].to_numpy("float64")
+        days = access.to_epoch_days(located["date_of_transfer"]).to_numpy("int64")
+        width = self.edges[1] - self.edges[0]
+        with np.errstate(divide="ignore"):
+            bins = np.floor((np.log10(prices) - self.edges[0]) / width)
+        frame = pd.DataFrame(
+            {
+                "month": days.astype("datetime64[D]")
+                .astype("datetime64[M]")
+                .astype("datetime64[ns]"),
+                "property_type": located["property_type"].astype(str).to_numpy(),
+                "bin": np.clip(bins, 0, self.bins - 1).astype("int16"),
+                "price": prices,
+            }
+        )
+
+        parts = {}
+        for level, column in CUBE_LEVELS.items():
+            grouped = frame.assign(region=located[column].to_numpy())
+            cells = grouped.groupby(["region", "month", "property_type"]).agg(
+                count=("price", "size"), mean=("price", "mean"), var=("price", "var")
+            )
+            # Centred sum of squares, none for a single sale
+            cells["m2"] = (cells.pop("var") * (cells["count"] - 1)).fillna(0.0)
+            histogram = grouped.groupby(
+                ["region", "month", "property_type", "bin"]
+            ).size()
+            parts[level] = (cells, histogram)
+        return parts
+
+    def _merge(self, parts: list, sign: int) -> None:
+        if not parts:
+            return
+        keys = ["region", "month", "property_type"]
+        for level in CUBE_LEVELS:
+            # Removed sales count negatively, with the same means
+            cells = pd.concat(
+                [
+                    self.cells[level],
+                    *(
+                        part[level][0].assign(
+                            count=sign * part[level][0]["count"],
+                            m2=sign * part[level][0]["m2"],
+                        )
+                        for part in parts
+                    ),
+                ]
+            )
+            count = cells["count"].groupby(level=keys).sum()
+            mean = (cells["count"] * cells["mean"]).groupby(level=keys).sum() / count
+            deviation = cells["mean"].to_numpy() - mean.reindex(cells.index).to_numpy()
+            m2 = (
+                (cells["m2"] + cells["count"] * deviation**2)
+                .groupby(level=keys)
+                .sum()
+            )
+            cells = pd.DataFrame({"count": count, "mean": mean, "m2": m2})
+            self.cells[level] = cells[cells["count"] != 0]
+            histogram = pd.concat(
+                [self.histograms[level], *(sign * part[level][1] for part in parts)]
+            )
+            histogram = histogram.groupby(
+                level=["region", "month", "property_type", "bin"]
+            ).sum()
+            self.histograms[level] = histogram[histogram != 0]
+
+    def locate(self, latitude: float, longitude: float) -> dict:
+        """Area, district and sector of the postcode nearest to a location, by great-circle distance"""
+        if self._tree is None:
+            from sklearn.neighbors import BallTree
+
+            coordinates = self.regions[["latitude", "longitude"]].to_numpy("float64")
+            self._located = np.flatnonzero(~np.isnan(coordinates).any(axis=1))
+            self._tree = BallTree(
+                np.radians(coordinates[self._located]), metric="haversine"
+            )
+        _, nearest = self._tree.query(np.radians([[latitude, longitude]]), k=1)
+        row = self.regions.iloc[int(self._located[nearest[0, 0]])]
+        return {level: row[column] for level, column in CUBE_LEVELS.items()}
+
+    def summary(
+        self,
+        region: str,
+        level: str = "sector",
+        property_type: str = None,
+        months: tuple = None,
+        quantiles: tuple = (0.25, 0.5, 0.75),
+    ) -> pd.Series:
+        """
+        Summary of the prices of the sales in a region, looked up in the cube
+        :param region: postcode area, district or sector, e.g. "SW", "SW19" or "SW19 1"
+        :param level: "area", "district" or "sector"
+        :param property_type: a property_type code, every type by default
+        :param months: (first, last) dates of the months summarised, inclusive, every month by default
+        :param quantiles: approximate quantiles, interpolated within the histogram bins
+        :return: count, mean, std and the quantiles of the prices
+        """
+        cells = self._lookup(self.cells[level], region, property_type, months)
+        histogram = self._lookup(self.histograms[level], region, property_type, months)
+        sizes = cells["count"].to_numpy("float64")
+        means = cells["mean"].to_numpy("float64")
+        count = int(sizes.sum())
+        summary = {"count": count, "mean": np.nan, "std": np.nan}
+        if count:
+            mean = (sizes * means).sum() / count
+            summary["mean"] = mean
+        if count > 1:
+            m2 = (cells["m2"].to_numpy("float64") + sizes * (means - mean) ** 2).sum()
+            summary["std"] = np.sqrt(max(m2, 0) / (count - 1))
+        counts = np.zeros(self.bins)
+        np.add.at(counts, histogram.index.get_level_values("bin"), histogram.to_numpy())
+        cumulative = np.concatenate([[0], np.cumsum(counts)])
+        for q in quantiles:
+            summary[f"q{q:g}"] = (
+                float(10 ** np.interp(q * count, cumulative, self.edges))
+                if count
+                else np.nan
+            )
+        return pd.Series(summary)
+
+    @staticmethod
+    def _lookup(table, region: str, property_type: str, months: tuple):
+        # The tables are sorted by region, so this is a binary search rather than a scan
+        try:
+            part = table.loc[[region]]
+        except KeyError:
+            return table.iloc[:0]
+        if property_type is not None:
+            part = part[part.index.get_level_values("property_type") == property_type]
+        if months is not None:
+            first, last = (
+                np.datetime64(pd.Timestamp(m), "M").astype("datetime64[ns]")
+                for m in months
+            )
+            month = part.index.get_level_values("month")
+            part = part[(month >= first) & (month <= last)]
+        return part
+
+
+# Values allowed in the code and enum columns of `pp_data` and `postcode_data`
+VALID_CODES = {
+    "property_type": ["D", "S", "T", "F", "O"],
+    "tenure_type": ["F", "L"],
+    "country": [
+        "England",
+        "Wales",
+        "Scotland",
+        "Northern Ireland",
+        "Channel Islands",
+        "Isle of Man",
+    ],
+}
+
+NUMERIC_COLUMNS = [
+    "price",
+    "easting",
+    "northing",
+    "positional_quality_indicator",
+    "latitude",
+    "longitude",
+    "db_id",
+]
+
+
+def profile(
+    table: str = "pp_data",
+    conn=None,
+    filenames: list = None,
+    chunksize: int = 100_000,
+    processes: int = None,
+    quantiles: tuple = (0.01, 0.25, 0.5, 0.75, 0.99),
+    sketch_size: int = 2048,
+) -> pd.DataFrame:
+    """
+    Profile the quality of `pp_data` or `postcode_data` in one pass over chunks, spread across a process pool.
+    Missing values are nulls and blank strings; invalid values are codes outside VALID_CODES, and values of the
+    numeric and date columns that do not parse. Distinct counts are HyperLogLog estimates and quantiles come from
+    mergeable sketches, so memory is bounded by the chunk size and the number of chunks in flight.
+    :param table: "pp_data" or "postcode_data"
+    :param conn: Connection to read the table from; the CSV files are read if None
+    :param filenames: CSV files of the table, the files loaded by access.data by default
+    :param chunksize: number of rows per chunk
+    :param processes: number of worker processes, the number of CPUs by default
+    :param quantiles: quantiles reported for the numeric and date columns
+    :param sketch_size: number of values kept by each level of a quantile sketch, the quantiles are within about
+        2 / sketch_size of the rows in rank
+    :return: data frame with a row per column: count, nulls, invalid, distinct, min, max and the quantiles
+    """
+    columns = access.PP_COLUMNS if table == "pp_data" else access.PC_COLUMNS
+    if conn is not None:
+        chunks = access.iter_query(
+            conn, f"SELECT * FROM `{table}`;", chunksize=chunksize
+        )
+    else:
+        if filenames is None:
+            filenames = (
+                [f"pp-{year}.csv" for year in range(2018, 2023)]
+                if table == "pp_data"
+                else ["open_postcode_geo.csv"]
+            )
+        chunks = _iter_csv_chunks(filenames, columns[:-1], chunksize)
+
+    processes = processes or os.cpu_count()
+    merged = None
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        pending = set()
+        for chunk in chunks:
+            pending.add(pool.submit(_profile_chunk, chunk, sketch_size))
+            # Bound the chunks in memory to two per worker
+            if len(pending) >= 2 * processes:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    merged = _merge_profiles(merged, future.result(), sketch_size)
+        for future in pending:
+            merged = _merge_profiles(merged, future.result(), sketch_size)
+
+    return _profile_report(merged, quantiles)
+
+
+def _iter_csv_chunks(filenames: list, columns: list, chunksize: int):
+    for filename in filenames:
+        if not os.path.isfile(filename):
+            print(f">>>File {filename} doesn't exist, skipped.")
+            continue
+        # Keep every field as read, so blanks and mis-encoded values can be counted
+        yield from pd.read_csv(
+            filename,
+            header=None,
+            names=columns,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=chunksize,
+        )
+
+
+def _profile_chunk(chunk: pd.DataFrame, sketch_size: int) -> dict:
+    """Partial profile of a chunk: for each column, the counts, extremes and sketches that _merge_profiles merges"""
+    result = {}
+    for column in chunk.columns:
+        values = chunk[column]
+        missing = values.isna() | (values.astype(str).str.strip() == "")
+        present = values[~missing]
+
+        if column in NUMERIC_COLUMNS or column == "date_of_transfer":
+            if column == "date_of_transfer":
+                parsed = access.parse_dates(present.astype(str), errors="coerce")
+                numbers = access.to_epoch_days(parsed[parsed.notna()]).astype("float64")
+                invalid = int(parsed.isna().sum())
+            else:
+                # Through strings, so the Decimal values of a database read as floats too
+                parsed = pd.to_numeric(present.astype(str), errors="coerce")
+                numbers = parsed[parsed.notna()].astype("float64")
+                invalid = int(parsed.isna().sum())
+            extremes = (
+                (numbers.min(), numbers.max()) if len(numbers) else (np.nan, np.nan)
+            )
+            sketch = _quantile_sketch(numbers.to_numpy(), sketch_size)
+        else:
+            text = present.astype(str)
+            invalid = (
+                int((~text.isin(VALID_CODES[column])).sum())
+                if column in VALID_CODES
+                else 0
+            )
+            extremes = (text.min(), text.max()) if len(text) else (np.nan, np.nan)
+            sketch = None
+
+        result[column] = {
+            "count": len(values),
+            "nulls": int(missing.sum()),
+            "invalid": invalid,
+            "min": extremes[0],
+            "max": extremes[1],
+            "registers": _hll_registers(present),
+            "sketch": sketch,
+        }
+    return result
+
+
+def _merge_profiles(a: dict, b: dict, sketch_size: int) -> dict:
+    if a is None:
+        return b
+    merged = {}
+    for column, x in a.items():
+        y = b[column]
+        merged[column] = {
+            "count": x["count"] + y["count"],
+            "nulls": x["nulls"] + y["nulls"],
+            "invalid": x["invalid"] + y["invalid"],
+            "min": _extreme(min, x["min"], y["min"]),
+            "max": _extreme(max, x["max"], y["max"]),
+            "registers": np.maximum(x["registers"], y["registers"]),
+            "sketch": None
+            if x["sketch"] is None
+            else _merge_sketches(x["sketch"], y["sketch"], sketch_size),
+        }
+    return merged
+
+
+def _extreme(function, x, y):
+    """min or max of two values, either of which may be nan for a chunk without values"""
+    if pd.isna(x):
+        return y
+    if pd.isna(y):
+        return x
+    return function(x, y)
+
+
+def _profile_report(merged: dict, quantiles: tuple) -> pd.DataFrame:
+    rows = {}
+    for column, stats in (merged or {}).items():
+        row = {
+            "count": stats["count"],
+            "nulls": stats["nulls"],
+            "invalid": stats["invalid"],
+            "distinct": _hll_estimate(stats["registers"]),
+            "min": stats["min"],
+            "max": stats["max"],
+        }
+        for q in quantiles:
+            row[f"q{q:g}"] = (
+                np.nan
+                if stats["sketch"] is None
+                else _sketch_quantile(stats["sketch"], q)
+            )
+        if column == "date_of_transfer":
+            # Dates were profiled as epoch days
+            for key in ["min", "max", *(f"q{q:g}" for q in quantiles)]:
+                if not pd.isna(row[key]):
+                    row[key] = access.from_epoch_days(
+                        pd.Series([round(row[key])])
+                    ).iloc[0]
+        rows[column] = row
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+# Number of index bits of the HyperLogLog sketches, 2 ** HLL_BITS registers of about 1% error
+HLL_BITS = 14
+
+
+def _hll_registers(values: pd.Series) -> np.ndarray:
+    """HyperLogLog registers of the distinct values"""
+    registers = np.zeros(1 << HLL_BITS, dtype="uint8")
+    if len(values) == 0:
+        return registers
+    hashes = pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy()
+    index = (hashes >> np.uint64(64 - HLL_BITS)).astype("int64")
+    # Rank of the first set bit of the remaining bits, from their top 53 bits, which a float holds exactly
+    rest = (hashes << np.uint64(HLL_BITS)) >> np.uint64(11)
+    top = np.maximum(rest.astype("float64"), 1)
+    rank = (53 - np.floor(np.log2(top))).astype("uint8")
+    np.maximum.at(registers, index, rank)
+    return registers
+
+
+def _hll_estimate(registers: np.ndarray) -> int:
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(2.0 ** -registers.astype("float64"))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros > 0:
+        # Small range correction by linear counting
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def _quantile_sketch(values: np.ndarray, size: int) -> list:
+    """Mergeable quantile sketch of the values of a chunk, see _merge_sketches"""
+    return [_compress_sketch(np.sort(values), np.ones(len(values)), size)]
+
+
+def _merge_sketches(a: list, b: list, size: int) -> list:
+    """
+    Merge two sketches. A sketch is a list of levels, level i holding None or the sorted values, with their
+    weights, standing evenly for 2 ** i chunks in at most size values. Levels are merged like binary addition,
+    so each value is compressed at most once per level. Each compression misplaces ranks by at most the weight
+    it compresses over size, so the rank error of the quantiles stays within about 2 / size of the rows,
+    however many chunks are merged.
+    """
+    merged = list(a)
+    for level, sketch in enumerate(b):
+        if sketch is not None:
+            _carry_sketch(merged, level, sketch, size)
+    return merged
+
+
+def _carry_sketch(levels: list, level: int, sketch: tuple, size: int) -> None:
+    """Add a sketch to levels at level, carrying to the level above while the level is taken"""
+    while True:
+        if level == len(levels):
+            levels.append(None)
+        if levels[level] is None:
+            levels[level] = sketch
+            return
+        sketch = _combine_sketches(levels[level], sketch, size)
+        levels[level] = None
+        level += 1
+
+
+def _combine_sketches(a: tuple, b: tuple, size: int) -> tuple:
+    values = np.concatenate([a[0], b[0]])
+    weights = np.concatenate([a[1], b[1]])
+    order = np.argsort(values, kind="stable")
+    return _compress_sketch(values[order], weights[order], size)
+
+
+def _compress_sketch(values: np.ndarray, weights: np.ndarray, size: int) -> tuple:
+    total = weights.sum()
+    if len(values) <= size:
+        return values, weights
+    # Keep the values at size evenly spaced ranks, each standing for an equal share of the weight
+    ranks = (np.arange(size) + 0.5) * total / size
+    positions = np.searchsorted(np.cumsum(weights), ranks)
+    return values[np.minimum(positions, len(values) - 1)], np.full(size, total / size)
+
+
+def _sketch_quantile(sketch: list, q: float) -> float:
+    # Every level together, without compressing them again
+    levels = [level for level in sketch if level is not None]
+    values = np.concatenate([level[0] for level in levels])
+    if len(values) == 0:
+        return np.nan
+    weights = np.concatenate([level[1] for level in levels])
+    order = np.argsort(values, kind="stable")
+    values, weights = values[order], weights[order]
+    cumulative = np.cumsum(weights) - weights / 2
+    return float(np.interp(q * weights.sum(), cumulative, values))
+
+
 def osm_view(
     place_name: str,
     latitude: float,
@@ -196,6 +976,9 @@ def osm_view(
     tags=None,
 ):
     """Provide a view of the data that allows the user to verify some aspect of its quality."""
+    import mlai.plot as plot
+    import osmnx as ox
+    from matplotlib import pyplot as plt
 
     if tags is None:
         tags = {
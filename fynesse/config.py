@@ -1,35 +1,96 @@
 import os
+from collections.abc import MutableMapping
+
 import yaml
 
 default_file = os.path.join(os.path.dirname(__file__), "defaults.yml")
 local_file = os.path.abspath(os.path.join(os.path.dirname(__file__), "machine.yml"))
 user_file = "_config.yml"
 
-config = {}
-
-if os.path.exists(default_file):
-    with open(default_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if os.path.exists(local_file):
-    with open(local_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if os.path.exists(user_file):
-    with open(user_file) as file:
-        config.update(yaml.load(file, Loader=yaml.FullLoader))
-
-if config == {}:
-    raise ValueError(
-        "No configuration file found at either "
-        + user_file
-        + " or "
-        + local_file
-        + " or "
-        + default_file
-        + "."
-    )
-
-for key, item in config.items():
-    if item is str:
-        config[key] = os.path.expandvars(item)
+
+def read_config() -> dict:
+    """Read the default, machine and user configuration files, later files overriding earlier ones"""
+    loaded = {}
+
+    if os.path.exists(default_file):
+        with open(default_file) as file:
+            loaded.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if os.path.exists(local_file):
+        with open(local_file) as file:
+            loaded.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if os.path.exists(user_file):
+        with open(user_file) as file:
+            loaded.update(yaml.load(file, Loader=yaml.FullLoader))
+
+    if loaded == {}:
+        raise ValueError(
+            "No configuration file found at either "
+            + user_file
+            + " or "
+            + local_file
+            + " or "
+            + default_file
+            + "."
+        )
+
+    for key, item in loaded.items():
+        if item is str:
+            loaded[key] = os.path.expandvars(item)
+    return loaded
+
+
+class Config(MutableMapping):
+    """The configuration, read from the files on first use rather than when fynesse is imported.
+    It is a mapping over the dict of read_config, loaded by any access to it, so it compares, copies and
+    iterates like that dict. dict(config) or config.copy() give a plain dict, e.g. for json.dumps.
+    """
+
+    def __init__(self):
+        self._data = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def _load(self) -> dict:
+        if self._data is None:
+            self._data = read_config()
+        return self._data
+
+    def reload(self) -> None:
+        """Read the configuration files again, e.g. after changing directory to one with a _config.yml"""
+        self._data = None
+        self._load()
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value) -> None:
+        self._load()[key] = value
+
+    def __delitem__(self, key) -> None:
+        del self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def __repr__(self) -> str:
+        return repr(self._load())
+
+    def copy(self) -> dict:
+        return dict(self._load())
+
+
+def _represent_config(dumper, data: Config):
+    return dumper.represent_dict(data.copy())
+
+
+yaml.add_representer(Config, _represent_config)
+yaml.add_representer(Config, _represent_config, Dumper=yaml.SafeDumper)
+
+config = Config()
@@ -0,0 +1,218 @@
+import csv
+import os
+import re
+import sqlite3
+
+"""Embedded, in-process database backend for the access layer.
+
+access is written against MariaDB through pymysql. EmbeddedConnection offers the part of the pymysql Connection and
+Cursor interface that access uses, on top of SQLite from the standard library, and translates the MariaDB statements
+access issues (table setup, LOAD DATA LOCAL INFILE, upserts, SHOW TABLES) to SQLite. The same access pipeline then
+runs locally, without a server or a network round trip, for benchmarks, tests and single-node analysis. """
+
+
+def connect(database: str = "property_prices", **kwargs) -> "EmbeddedConnection":
+    """Open an embedded database stored in a local file.
+    :param database: file name, ".sqlite" is appended if it has no extension
+    :param kwargs: server connection arguments (user, password, host, port), ignored
+    """
+    path = database
+    if path != ":memory:" and not os.path.splitext(path)[1]:
+        path = f"{path}.sqlite"
+    return EmbeddedConnection(path)
+
+
+class EmbeddedConnection:
+    """A SQLite connection with the pymysql Connection methods used by access"""
+
+    def __init__(self, path: str):
+        # Autocommit like the MariaDB connections of access; writers from other threads wait for the lock
+        self._conn = sqlite3.connect(
+            path, isolation_level=None, timeout=600, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode = WAL;")
+        self._conn.execute("PRAGMA synchronous = NORMAL;")
+        self._affected_rows = 0
+
+    def cursor(self, cursor_class=None) -> "EmbeddedCursor":
+        """SQLite cursors already step through results lazily, so cursor_class (e.g. SSCursor) is ignored"""
+        return EmbeddedCursor(self)
+
+    def begin(self) -> None:
+        self._conn.execute("BEGIN;")
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def rollback(self) -> None:
+        self._conn.rollback()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def affected_rows(self) -> int:
+        return self._affected_rows
+
+
+class EmbeddedCursor:
+    """A SQLite cursor that accepts the MariaDB statements and %s parameters issued by access"""
+
+    def __init__(self, connection: EmbeddedConnection):
+        self.connection = connection
+        self._cursor = connection._conn.cursor()
+        # Set when the last statement had no SQLite equivalent and was skipped
+        self._skipped = False
+        self.rowcount = -1
+
+    @property
+    def description(self):
+        return None if self._skipped else self._cursor.description
+
+    def execute(self, query: str, args=None) -> int:
+        statement = translate(query)
+        self._skipped = statement is None
+        if self._skipped:
+            self.rowcount = 0
+        elif isinstance(statement, tuple):
+            filename, table_name = statement
+            self.rowcount = load_csv(self.connection._conn, filename, table_name)
+        else:
+            self._cursor.execute(statement, () if args is None else args)
+            self.rowcount = self._cursor.rowcount
+        self.connection._affected_rows = self.rowcount
+        return self.rowcount
+
+    def executemany(self, query: str, args) -> int:
+        statement = translate(query)
+        self._skipped = statement is None
+        if not self._skipped:
+            self._cursor.executemany(statement, args)
+        self.rowcount = 0 if self._skipped else self._cursor.rowcount
+        self.connection._affected_rows = self.rowcount
+        return self.rowcount
+
+    def fetchone(self):
+        return None if self._skipped else self._cursor.fetchone()
+
+    def fetchmany(self, size: int = 1) -> tuple:
+        return () if self._skipped else tuple(self._cursor.fetchmany(size))
+
+    def fetchall(self) -> tuple:
+        return () if self._skipped else tuple(self._cursor.fetchall())
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+def _strip_comments(query: str) -> str:
+    lines = [line for line in query.splitlines() if not line.strip().startswith("--")]
+    return "\n".join(lines).strip()
+
+
+def translate(query: str):
+    """
+    Translate a MariaDB statement issued by access to SQLite.
+    :return: the SQLite statement, None for a statement with no SQLite equivalent (database options, keys added
+    after loading, which SQLite gives every table through `db_id` INTEGER PRIMARY KEY), or a (filename, table_name)
+    pair for LOAD DATA LOCAL INFILE, which is carried out by load_csv
+    """
+    statement = _strip_comments(query)
+    upper = statement.upper()
+
+    if upper.startswith(("SET ", "USE ", "CREATE DATABASE")):
+        return None
+    if upper.startswith("ALTER TABLE") and re.search(
+        r"ADD PRIMARY KEY|MODIFY|`db_id`", statement, flags=re.IGNORECASE
+    ):
+        return None
+
+    load = re.match(
+        r"LOAD DATA LOCAL INFILE '(.+?)' INTO TABLE `?(\w+)`?", statement, re.IGNORECASE
+    )
+    if load is not None:
+        return load.group(1), load.group(2)
+
+    if upper.startswith("SHOW TABLES LIKE"):
+        statement = (
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s;"
+        )
+    elif upper.startswith("SHOW TABLES"):
+        statement = "SELECT name FROM sqlite_master WHERE type = 'table';"
+
+    if upper.startswith("CREATE TABLE"):
+        statement = re.sub(r"\s+COLLATE\s+utf8_bin", "", statement)
+        statement = re.sub(r"\)\s*DEFAULT CHARSET=[^;]*;?\s*$", ");", statement)
+        statement = re.sub(r"\benum\([^)]*\)", "text", statement)
+        statement = re.sub(r"\s+unsigned\b", "", statement)
+        statement = re.sub(
+            r"`db_id` bigint\(20\) NOT NULL", "`db_id` INTEGER PRIMARY KEY", statement
+        )
+    if upper.startswith("CREATE INDEX"):
+        # SQLite indexes whole columns, not prefixes
+        statement = re.sub(r"(\w)\(\d+\)", r"\1", statement)
+
+    if "ON DUPLICATE KEY UPDATE" in upper:
+        statement = re.sub(
+            r"\s+ON DUPLICATE KEY UPDATE.*?(;?)\s*$",
+            r"\1",
+            statement,
+            flags=re.DOTALL | re.IGNORECASE,
+        )
+        statement = re.sub(
+            r"^INSERT INTO", "INSERT OR REPLACE INTO", statement, flags=re.IGNORECASE
+        )
+
+    statement = statement.replace("%s", "?")
+    statement = statement.replace("UTC_TIMESTAMP()", "CURRENT_TIMESTAMP")
+    statement = re.sub(
+        r"\bYEAR\(([^()]*)\)", r"CAST(strftime('%Y', \1) AS INTEGER)", statement
+    )
+    return statement
+
+
+def load_csv(
+    conn: sqlite3.Connection, filename: str, table_name: str, batch_size: int = 50_000
+) -> int:
+    """
+    Load a CSV file into a table like LOAD DATA LOCAL INFILE: fields fill the table columns in order,
+    and date columns keep only their date part
+    :return: number of rows loaded
+    """
+    table_info = conn.execute(f"PRAGMA table_info(`{table_name}`);").fetchall()
+    columns = [row[1] for row in table_info]
+    date_indices = [i for i, row in enumerate(table_info) if row[2].lower() == "date"]
+
+    loaded = 0
+    with open(filename, newline="") as f:
+        reader = csv.reader(f)
+        batch = []
+        for row in reader:
+            row = row[: len(columns)]
+            for i in date_indices:
+                if i < len(row):
+                    row[i] = row[i][:10]
+            batch.append(row)
+            if len(batch) == batch_size:
+                loaded += _insert_batch(conn, table_name, columns, batch)
+                batch = []
+        if batch:
+            loaded += _insert_batch(conn, table_name, columns, batch)
+    return loaded
+
+
+def _insert_batch(
+    conn: sqlite3.Connection, table_name: str, columns: list, batch: list
+) -> int:
+    width = len(batch[0])
+    conn.execute("BEGIN;")
+    try:
+        conn.executemany(
+            f"INSERT INTO `{table_name}` ({', '.join(f'`{c}`' for c in columns[:width])}) "
+            f"VALUES ({', '.join(['?'] * width)});",
+            batch,
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(batch)
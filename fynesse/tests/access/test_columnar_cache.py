@@ -0,0 +1,32 @@
+import unittest
+
+from fynesse import access
+from fynesse.tests import fixtures
+
+
+class TestColumnarCache(fixtures.DatasetTestCase):
+    connect = False
+
+    def setUp(self):
+        super().setUp()
+        self.written = access.stream_join_pp_pc(chunksize=100, years=self.rows)
+
+    def test_rewrite_replaces_previous_parts(self):
+        access.write_columnar_cache(
+            "prices_coordinates_data.csv", "cache", chunksize=100
+        )
+        self.assertEqual(len(access.read_columnar_cache("cache")), self.written)
+        # Fewer, larger chunks do not overwrite every part file of the first write
+        access.write_columnar_cache(
+            "prices_coordinates_data.csv", "cache", chunksize=250
+        )
+        data = access.read_columnar_cache("cache", compact=False)
+        self.assertEqual(len(data), self.written)
+        self.assertEqual(
+            data.groupby(data["date_of_transfer"].dt.year).size().to_dict(),
+            {year: len(rows) for year, rows in self.rows.items()},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+from fynesse import config as config_module
+from fynesse.config import Config, read_config
+
+# Directory holding the fynesse package, for the fresh interpreters below
+ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    """Run a fresh interpreter able to import fynesse"""
+    return subprocess.run(
+        [sys.executable, *args],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        with open(config_module.user_file, "w") as file:
+            yaml.dump({"backend": "embedded", "port": 1234}, file)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_import_does_not_read_config(self):
+        result = run_python(
+            "-c",
+            "import sys, fynesse, fynesse.config;"
+            "print(fynesse.config.config.loaded, 'pandas' in sys.modules)",
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), ["False", "False"])
+
+    def test_behaves_as_loaded_dict(self):
+        expected = read_config()
+        self.assertEqual(dict(Config()), expected)
+        self.assertEqual(Config(), expected)
+        self.assertEqual(Config().copy(), expected)
+        self.assertEqual(len(Config()), len(expected))
+        self.assertEqual(Config()["port"], 1234)
+        self.assertIn("backend", Config())
+        self.assertEqual(json.loads(json.dumps(dict(Config()))), expected)
+        self.assertEqual(yaml.safe_load(yaml.safe_dump(Config())), expected)
+
+    def test_mutating_methods_load_first(self):
+        config = Config()
+        self.assertEqual(config.setdefault("port", 1), 1234)
+        self.assertEqual(config.pop("backend"), "embedded")
+        self.assertNotIn("backend", config)
+        self.assertIn("model_cache_size", config)
+
+    def test_reload(self):
+        config = Config()
+        self.assertEqual(config["port"], 1234)
+        with open(config_module.user_file, "w") as file:
+            yaml.dump({"port": 4321}, file)
+        self.assertEqual(config["port"], 1234)
+        config.reload()
+        self.assertEqual(config["port"], 4321)
+
+
+class TestImportTime(unittest.TestCase):
+    """Import times depend on the machine and its load, so they are only reported, and checked against the
+    budgets when FYNESSE_BENCHMARK is set, as in a dedicated benchmark job"""
+
+    def test_within_budget(self):
+        budgets = Config().get("import_time_budget", {})
+        self.assertTrue(budgets)
+        for module, budget in budgets.items():
+            with self.subTest(module=module):
+                result = run_python("-X", "importtime", "-c", f"import {module}")
+                self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+                # Lines of -X importtime read "import time: self [us] | cumulative [us] | module"
+                cumulative = [
+                    int(line.split("|")[1])
+                    for line in result.stderr.splitlines()
+                    if line.split("|")[-1].strip() == module
+                ]
+                self.assertTrue(cumulative, f"{module} was not imported")
+                milliseconds = cumulative[-1] / 1000
+                print(
+                    f">>>Imported {module} in {milliseconds:.0f} ms, budget {budget} ms"
+                )
+                if os.environ.get("FYNESSE_BENCHMARK"):
+                    self.assertLessEqual(milliseconds, budget)
+
+
+if __name__ == "__main__":
+    unittest.main()
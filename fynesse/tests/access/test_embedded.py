@@ -0,0 +1,92 @@
+import os
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from fynesse import access, embedded
+from fynesse.tests import fixtures
+
+
+class TestEmbeddedBackend(fixtures.DatasetTestCase):
+    def load(self):
+        access.setup_pp_data(self.conn)
+        for year in self.rows:
+            access.upload_csv_to_table(self.conn, f"pp-{year}.csv", "pp_data")
+        access.setup_postcode_data(self.conn)
+        access.upload_csv_to_table(self.conn, "open_postcode_geo.csv", "postcode_data")
+        access.index_postcode_data(self.conn)
+        access.index_filter_columns(self.conn)
+
+    def test_connection_is_a_local_file(self):
+        self.assertIsInstance(self.conn, embedded.EmbeddedConnection)
+        self.assertTrue(os.path.isfile("property_prices.sqlite"))
+
+    def test_load_and_join(self):
+        self.load()
+        self.assertTrue(access.table_exists(self.conn, "pp_data"))
+        self.assertFalse(access.table_exists(self.conn, "no_such_table"))
+        cur = self.conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM pp_data;")
+        self.assertEqual(cur.fetchone()[0], sum(map(len, self.rows.values())))
+
+        joined = pd.DataFrame(access.join_pp_pc(self.conn), columns=access.PCD_COLUMNS)
+        self.assertEqual(len(joined.index), sum(map(len, self.rows.values())))
+        self.assertEqual(set(joined["country"]), {"England"})
+        # Dates are stored without the time of day of the CSV files
+        self.assertTrue(joined["date_of_transfer"].astype(str).str.len().eq(10).all())
+
+    def test_upsert(self):
+        access.setup_load_manifest(self.conn)
+        access.record_load(self.conn, "pp-2018.csv", "a")
+        access.record_load(self.conn, "pp-2018.csv", "b")
+        self.assertEqual(access.get_loaded_checksum(self.conn, "pp-2018.csv"), "b")
+        self.assertIsNone(access.get_loaded_checksum(self.conn, "pp-2019.csv"))
+
+    def test_select_and_count_prices(self):
+        self.load()
+        bounding_box = (51.545, 51.505, -0.095, -0.055)
+        date_range = ("2018-06-01", "2020-06-01")
+        selected = access.select_prices(
+            self.conn, bounding_box, date_range, ["D", "F"], source="join"
+        )
+        count = access.count_prices(
+            self.conn, bounding_box, date_range, ["D", "F"], source="join"
+        )
+        self.assertEqual(len(selected.index), count)
+        self.assertGreater(count, 0)
+
+        expected = pd.DataFrame(
+            [row for rows in self.rows.values() for row in rows],
+            columns=access.PP_COLUMNS[:-1],
+        )
+        locations = pd.DataFrame(
+            fixtures.POSTCODES, columns=["postcode", "latitude", "longitude"]
+        )
+        expected = expected.merge(locations, on="postcode")
+        dates = expected["date_of_transfer"].str[:10]
+        expected = expected[
+            (expected.latitude < 51.545)
+            & (expected.latitude > 51.505)
+            & (expected.longitude < -0.055)
+            & (expected.longitude > -0.095)
+            & (dates > "2018-06-01")
+            & (dates < "2020-06-01")
+            & expected.property_type.isin(["D", "F"])
+        ]
+        self.assertEqual(count, len(expected.index))
+
+    def test_data_end_to_end(self):
+        with mock.patch.dict(access.config, {"backend": "embedded"}):
+            df = access.data(materialize=True)
+        self.assertEqual(len(df.index), sum(map(len, self.rows.values())))
+        self.assertEqual(list(df.columns), access.PCD_COLUMNS)
+        self.assertEqual(access.prices_source(self.conn), "prices_coordinates_data")
+        self.assertEqual(
+            access.count_prices(self.conn),
+            access.count_prices(self.conn, source="join"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from unittest import mock
+
+from fynesse import access
+from fynesse.tests import fixtures
+
+
+class TestIngestIncremental(fixtures.DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.pp_filenames = [f"pp-{year}.csv" for year in self.rows]
+
+    def ingest(self, update_filenames=()):
+        return dict(
+            access.ingest_incremental(
+                self.conn, self.pp_filenames, "open_postcode_geo.csv", update_filenames
+            )
+        )
+
+    def count(self, sql: str) -> int:
+        cur = self.conn.cursor()
+        cur.execute(sql)
+        return cur.fetchone()[0]
+
+    def year_count(self, year: int) -> int:
+        stats = access.get_price_stats(self.conn)
+        return access.count_from_stats(stats, [year])
+
+    def test_loads_then_skips(self):
+        actions = self.ingest()
+        self.assertEqual(set(actions.values()), {"loaded"})
+        self.assertEqual(
+            self.count("SELECT COUNT(*) FROM pp_data;"),
+            sum(map(len, self.rows.values())),
+        )
+        actions = self.ingest()
+        self.assertEqual(set(actions.values()), {"skipped"})
+        self.assertEqual(
+            self.count("SELECT COUNT(*) FROM pp_data;"),
+            sum(map(len, self.rows.values())),
+        )
+
+    def test_changed_year_replaces_its_rows(self):
+        self.ingest()
+        # Drop some sales from 2019, and add new ones
+        rows = self.rows[2019][50:] + fixtures.sales(2019, 10, seed=1)
+        fixtures.write_sales("pp-2019.csv", rows)
+
+        actions = self.ingest()
+        self.assertEqual(actions["pp-2019.csv"], "replaced")
+        self.assertEqual(actions["pp-2018.csv"], "skipped")
+        self.assertEqual(self.year_count(2019), len(rows))
+        self.assertEqual(self.year_count(2018), len(self.rows[2018]))
+        self.assertEqual(
+            self.count(
+                "SELECT COUNT(*) FROM pp_data WHERE date_of_transfer BETWEEN '2019-01-01' AND '2019-12-31';"
+            ),
+            len(rows),
+        )
+        removed = self.rows[2019][0][0]
+        self.assertEqual(
+            self.count(
+                f"SELECT COUNT(*) FROM pp_data WHERE transaction_unique_identifier = '{removed}';"
+            ),
+            0,
+        )
+
+    def test_monthly_update(self):
+        self.ingest()
+        added = fixtures.sales(2020, 3, seed=2)
+        changed = [list(row) for row in self.rows[2020][:2]]
+        for row in changed:
+            row[1], row[15] = "123456", "C"
+        deleted = [list(row) for row in self.rows[2020][2:4]]
+        for row in deleted:
+            row[15] = "D"
+        fixtures.write_sales("update.csv", added + changed + deleted)
+
+        actions = self.ingest(["update.csv"])
+        self.assertEqual(actions["update.csv"], "updated")
+        self.assertEqual(self.year_count(2020), len(self.rows[2020]) + 3 - 2)
+        self.assertEqual(
+            self.count("SELECT COUNT(*) FROM pp_data WHERE price = 123456;"), 2
+        )
+        self.assertEqual(set(self.ingest(["update.csv"]).values()), {"skipped"})
+
+    def test_yearly_file_after_monthly_update(self):
+        self.ingest()
+        updates = fixtures.sales(2021, 30, seed=3)
+        fixtures.write_sales("update.csv", updates)
+        self.ingest(["update.csv"])
+        self.assertEqual(self.year_count(2021), 30)
+
+        # The yearly file holds the sales of the update again, and new ones
+        fixtures.write_sales("pp-2021.csv", updates + fixtures.sales(2021, 70, seed=4))
+        self.pp_filenames.append("pp-2021.csv")
+        actions = self.ingest(["update.csv"])
+        self.assertEqual(actions["pp-2021.csv"], "loaded")
+        self.assertEqual(self.year_count(2021), 100)
+        self.assertEqual(
+            self.count(
+                "SELECT COUNT(DISTINCT transaction_unique_identifier) FROM pp_data "
+                "WHERE date_of_transfer BETWEEN '2021-01-01' AND '2021-12-31';"
+            ),
+            100,
+        )
+
+    def test_keeps_materialized_join_in_step(self):
+        self.ingest()
+        access.build_prices_coordinates_data(self.conn)
+        fixtures.write_sales("pp-2018.csv", self.rows[2018][:20])
+        self.ingest()
+        self.assertEqual(
+            access.count_prices(self.conn),
+            access.count_prices(self.conn, source="join"),
+        )
+        self.assertEqual(access.prices_source(self.conn), "prices_coordinates_data")
+
+    def test_full_load_without_materialize(self):
+        with mock.patch.dict(access.config, {"backend": "embedded"}):
+            access.data(materialize=True)
+            access.data()
+        self.assertFalse(access.table_exists(self.conn, "prices_coordinates_progress"))
+        self.assertFalse(access.table_exists(self.conn, "prices_coordinates_data"))
+        # A later ingest does not start materializing the join
+        fixtures.write_sales("pp-2018.csv", self.rows[2018][:20])
+        self.ingest()
+        self.assertFalse(access.table_exists(self.conn, "prices_coordinates_data"))
+        self.assertEqual(access.prices_source(self.conn), "join")
+
+
+if __name__ == "__main__":
+    unittest.main()
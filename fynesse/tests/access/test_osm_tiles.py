@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+import yaml
+
+from fynesse import access
+
+
+class TestOSMTiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+        pois = pd.DataFrame(
+            {
+                "latitude": [51.51, 51.52, 51.61, -0.05],
+                "longitude": [-0.11, -0.12, -0.11, -0.05],
+                "key": ["amenity", "shop", "leisure", "tourism"],
+            }
+        )
+        for (row, column), tile in pois.groupby(
+            [(pois.latitude // 0.1).astype(int), (pois.longitude // 0.1).astype(int)]
+        ):
+            tile.to_parquet(os.path.join(self.root, f"{row}_{column}.parquet"))
+        with open(os.path.join(self.root, "tiles.yml"), "w") as file:
+            yaml.dump({"tile_size": 0.1, "keys": access.OSM_KEYS}, file)
+        self.tiles = access.OSMTiles(self.root, maxsize=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_points_in_box(self):
+        self.assertEqual(self.tiles.existing, {(515, -2), (516, -2), (-1, -1)})
+        pois = self.tiles.points((51.55, 51.5, -0.2, 0))
+        self.assertEqual(sorted(pois.key), ["amenity", "shop"])
+        pois = self.tiles.points((51.45, 51.4, -0.2, 0))
+        self.assertEqual(len(pois.index), 0)
+        self.assertEqual(list(pois.columns), ["latitude", "longitude", "key"])
+
+    def test_box_beyond_the_globe(self):
+        # Only the tiles written are read, however many the box covers
+        pois = self.tiles.points((379.18, -276.18, -327.78, 327.58))
+        self.assertEqual(len(pois.index), 4)
+        self.assertEqual(self.tiles.misses, 3)
+        self.assertLessEqual(len(self.tiles.tiles), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import datetime
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from fynesse import access, address
+from fynesse.tests import fixtures
+
+DATE_RANGE = (datetime.date(1995, 1, 1), datetime.date(2023, 12, 31))
+
+
+def assert_on_globe(test: unittest.TestCase, bounding_box):
+    north, south, west, east = bounding_box
+    test.assertTrue(-90 <= south < north <= 90, bounding_box)
+    test.assertTrue(-180 <= west < east <= 180, bounding_box)
+
+
+class TestBoundingBoxFromDatabase(fixtures.DatasetTestCase):
+    def setUp(self):
+        super().setUp()
+        # Sales at postcodes missing from the postcode file, which only the LEFT JOIN counts
+        unlocated = [("ZZ1 1ZZ", None, None), ("ZZ2 2ZZ", None, None)]
+        fixtures.write_sales(
+            "pp-2021.csv", fixtures.sales(2021, 50, postcodes=unlocated)
+        )
+        access.ingest_incremental(
+            self.conn,
+            [f"pp-{year}.csv" for year in [*self.rows, 2021]],
+            "open_postcode_geo.csv",
+        )
+
+    def bounding_box(self, property_type="D", **kwargs):
+        count_prices = access.count_prices
+        calls = []
+
+        def counted(*args, **kw):
+            calls.append(args)
+            # A search doubling from 0.01 degrees covers the globe in 16 steps
+            self.assertLess(len(calls), 20, "the bounding box search does not stop")
+            return count_prices(*args, **kw)
+
+        with mock.patch.object(access, "count_prices", counted):
+            return address._get_bounding_box_from_db(
+                51.55, -0.05, self.conn, DATE_RANGE, property_type, "join", **kwargs
+            )
+
+    def located(self, bounding_box, property_type="D") -> int:
+        return access.count_prices(
+            self.conn, bounding_box, DATE_RANGE, [property_type], "join"
+        )
+
+    def test_stops_with_unlocated_sales(self):
+        stats = access.get_price_stats(self.conn)
+        # The statistics count the unlocated sales too, more than any box can hold
+        self.assertGreater(
+            access.count_from_stats(stats, property_types=["D"]),
+            self.located((91, -91, -181, 181)),
+        )
+        bounding_box = self.bounding_box()
+        self.assertEqual(self.located(bounding_box), self.located((91, -91, -181, 181)))
+
+    def test_stops_without_price_stats(self):
+        cur = self.conn.cursor()
+        cur.execute("DROP TABLE `price_stats`;")
+        bounding_box = self.bounding_box()
+        self.assertEqual(self.located(bounding_box), self.located((91, -91, -181, 181)))
+        assert_on_globe(self, bounding_box)
+
+    def test_grows_until_threshold(self):
+        stats = access.get_price_stats(self.conn)
+        with mock.patch.object(access, "count_from_stats", return_value=20):
+            north, south, west, east = self.bounding_box(stats=stats)
+        self.assertGreaterEqual(self.located((north, south, west, east)), 20)
+        # The box before the last one held too few
+        height = (north - south) / 2
+        smaller = (
+            51.55 + height / 2,
+            51.55 - height / 2,
+            -0.05 - height / 2,
+            -0.05 + height / 2,
+        )
+        self.assertLess(self.located(smaller), 20)
+
+    def test_no_located_sales(self):
+        with self.assertRaises(ValueError):
+            self.bounding_box("O")
+        cur = self.conn.cursor()
+        cur.execute("DROP TABLE `price_stats`;")
+        with self.assertRaises(ValueError):
+            self.bounding_box("O")
+
+
+class TestBoundingBoxInMemory(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 2000
+        self.data = address.assess.pd.DataFrame(
+            {
+                "price": rng.integers(50_000, 1_000_000, n),
+                "latitude": rng.uniform(51.4, 51.6, n),
+                "longitude": rng.uniform(-0.2, 0.0, n),
+                "date_of_transfer": access.from_epoch_days(
+                    address.assess.pd.Series(rng.integers(17_500, 19_000, n))
+                ),
+                "property_type": rng.choice(list("DSTF"), n),
+            }
+        )
+        self.prepared = address.PreparedDataset(self.data)
+
+    def test_does_not_compute_stats_per_prediction(self):
+        with mock.patch.object(
+            access, "price_stats_from_dataframe", side_effect=AssertionError
+        ):
+            bounding_box = address._get_bounding_box(
+                51.5, -0.1, self.data, DATE_RANGE, "D"
+            )
+        # Fewer sales than the threshold, so the box grows to cover them all
+        selected = address._get_pcd_data(self.data, bounding_box, DATE_RANGE, "D")
+        self.assertEqual(len(selected.index), (self.data.property_type == "D").sum())
+        assert_on_globe(self, bounding_box)
+
+    def test_prepared_matches_data_frame(self):
+        stats = self.prepared.stats
+        self.assertEqual(
+            address._get_bounding_box(51.5, -0.1, self.prepared, DATE_RANGE, "F"),
+            address._get_bounding_box(51.5, -0.1, self.data, DATE_RANGE, "F", stats),
+        )
+
+    def test_no_located_sales(self):
+        stats = self.prepared.stats
+        with self.assertRaises(ValueError):
+            address._get_bounding_box(51.5, -0.1, self.prepared, DATE_RANGE, "O")
+        unlocated = stats.assign(
+            min_latitude=np.nan,
+            max_latitude=np.nan,
+            min_longitude=np.nan,
+            max_longitude=np.nan,
+        )
+        with self.assertRaises(ValueError):
+            address._get_bounding_box(51.5, -0.1, self.data, DATE_RANGE, "D", unlocated)
+
+
+if __name__ == "__main__":
+    unittest.main()
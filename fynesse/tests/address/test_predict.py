@@ -0,0 +1,133 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from fynesse import access, address
+
+
+def synthetic_sales(n: int = 3000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    latitude = rng.uniform(51.4, 51.6, n)
+    longitude = rng.uniform(-0.2, 0.0, n)
+    days = rng.integers(17_500, 19_000, n)
+    return pd.DataFrame(
+        {
+            "price": (200_000 + 1e6 * (latitude - 51.4) + 50 * (days - 17_500)).astype(
+                int
+            ),
+            "latitude": latitude,
+            "longitude": longitude,
+            "date_of_transfer": access.from_epoch_days(pd.Series(days)),
+            "property_type": rng.choice(list("DF"), n),
+        }
+    )
+
+
+QUERIES = pd.DataFrame(
+    {
+        "latitude": [51.45, 51.5, 51.55, 51.5],
+        "longitude": [-0.15, -0.1, -0.05, -0.1],
+        "date": pd.to_datetime(["2020-01-01"] * 4),
+        "property_type": ["D", "F", "D", "D"],
+    }
+)
+
+
+class TestPredictPrices(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dataset = address.PreparedDataset(synthetic_sales())
+        cls.queries = QUERIES
+
+    def test_empty_queries(self):
+        predictions = address.predict_prices(self.dataset, self.queries.iloc[:0])
+        self.assertEqual(len(predictions.index), 0)
+        self.assertEqual(list(predictions.columns), address.PREDICTION_COLUMNS)
+        self.assertTrue((predictions.dtypes == float).all())
+
+    def test_duplicate_index_labels(self):
+        queries = self.queries.set_axis([7, 7, 3, 3])
+        predictions = address.predict_prices(self.dataset, queries)
+        expected = address.predict_prices(self.dataset, self.queries)
+        self.assertEqual(list(predictions.index), [7, 7, 3, 3])
+        np.testing.assert_allclose(predictions.to_numpy(), expected.to_numpy())
+        # Each query is predicted from its own location
+        for position in range(len(queries.index)):
+            query = self.queries.iloc[position]
+            _, prediction, bounding_box = address.predict_price(
+                self.dataset,
+                query.latitude,
+                query.longitude,
+                query.date,
+                query.property_type,
+                box_index=self.dataset.box_index,
+            )
+            self.assertAlmostEqual(predictions.prediction.iloc[position], prediction[0])
+            # The box is searched around the location rounded to model_cache_resolution
+            np.testing.assert_allclose(predictions.iloc[position, 2:], bounding_box)
+
+    def test_nearby_queries_share_a_fit(self):
+        rng = np.random.default_rng(2)
+        queries = pd.DataFrame(
+            {
+                "latitude": 51.5 + rng.uniform(-0.002, 0.002, 100),
+                "longitude": -0.1 + rng.uniform(-0.002, 0.002, 100),
+                "date": pd.to_datetime(["2020-01-01"] * 100),
+                "property_type": ["D"] * 100,
+            }
+        )
+        with mock.patch.object(
+            address, "_fit_in_box", wraps=address._fit_in_box
+        ) as fit:
+            predictions = address.predict_prices(self.dataset, queries)
+        self.assertEqual(fit.call_count, 1)
+        self.assertEqual(len(predictions.drop_duplicates(["north", "south"])), 1)
+        # Each query is still predicted from its own location
+        self.assertGreater(predictions.prediction.nunique(), 1)
+
+        with mock.patch.object(
+            address, "_fit_in_box", wraps=address._fit_in_box
+        ) as fit:
+            address.predict_prices(self.dataset, queries.iloc[:10], resolution=0)
+        self.assertEqual(fit.call_count, 10)
+
+
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        self.data = synthetic_sales(seed=1)
+        self.queries = QUERIES
+
+    def test_hit_skips_selection(self):
+        cache = address.ModelCache()
+        predictions = address.predict_prices(self.data, self.queries, model_cache=cache)
+        self.assertEqual(cache.info()["hits"], 0)
+        with mock.patch.object(
+            address, "prepare", side_effect=AssertionError("prepared")
+        ), mock.patch.object(
+            address, "_get_bounding_box_indexed", side_effect=AssertionError("searched")
+        ):
+            cached = address.predict_prices(self.data, self.queries, model_cache=cache)
+            query = self.queries.iloc[0]
+            with mock.patch.object(
+                address,
+                "_get_learning_bounding_box",
+                side_effect=AssertionError("searched"),
+            ):
+                _, prediction, bounding_box = address.predict_price(
+                    self.data,
+                    query.latitude,
+                    query.longitude,
+                    query.date,
+                    query.property_type,
+                    model_cache=cache,
+                )
+        np.testing.assert_allclose(cached.to_numpy(), predictions.to_numpy())
+        self.assertAlmostEqual(prediction[0], predictions.prediction.iloc[0])
+        self.assertEqual(bounding_box, tuple(predictions.iloc[0, 2:]))
+        self.assertEqual(cache.info()["hits"], len(self.queries.index) + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
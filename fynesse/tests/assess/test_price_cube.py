@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from fynesse import access, assess
+from fynesse.tests import fixtures
+
+
+class TestPriceCube(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "open_postcode_geo.csv")
+            fixtures.write_postcodes(filename)
+            cls.regions = access.load_postcode_regions(filename)
+        rows = [row for year in range(2018, 2021) for row in fixtures.sales(year, 400)]
+        cls.sales = pd.DataFrame(rows, columns=access.PP_COLUMNS[:-1])
+        cls.sales["price"] = cls.sales["price"].astype(int)
+        located = cls.sales.join(cls.regions, on="postcode", how="inner")
+        cls.located = located.assign(
+            month=pd.to_datetime(located.date_of_transfer.str[:10])
+            .dt.to_period("M")
+            .dt.start_time
+        )
+
+    def build(self, sales, chunksize=100) -> assess.PriceCube:
+        return assess.PriceCube.build(
+            (
+                sales.iloc[i : i + chunksize]
+                for i in range(0, len(sales.index), chunksize)
+            ),
+            self.regions,
+        )
+
+    def assertSummary(self, summary, prices):
+        self.assertEqual(summary["count"], len(prices))
+        self.assertAlmostEqual(summary["mean"], prices.mean(), delta=1e-6)
+        self.assertAlmostEqual(summary["std"], prices.std(), delta=1e-6)
+
+    def test_summaries_match_the_sales(self):
+        cube = self.build(self.sales)
+        sales = self.located
+        self.assertSummary(cube.summary("AB", "area"), sales.price)
+        district = sales[
+            (sales.postcode_district == "AB3") & (sales.property_type == "D")
+        ]
+        self.assertSummary(cube.summary("AB3", "district", "D"), district.price)
+        months = sales[
+            (sales.postcode_sector == "AB3 4")
+            & (sales.month >= "2019-03-01")
+            & (sales.month <= "2020-06-01")
+        ]
+        self.assertSummary(
+            cube.summary("AB3 4", "sector", months=("2019-03-15", "2020-06-01")),
+            months.price,
+        )
+        self.assertEqual(cube.summary("ZZ9 9", "sector")["count"], 0)
+
+    def test_add_and_remove(self):
+        grown = self.build(self.sales.iloc[:500])
+        grown.add(self.sales.iloc[500:])
+        grown.remove(self.sales.iloc[:500])
+        expected = self.build(self.sales.iloc[500:])
+        for level in assess.CUBE_LEVELS:
+            self.assertTrue(
+                grown.cells[level].index.equals(expected.cells[level].index)
+            )
+            np.testing.assert_allclose(
+                grown.cells[level].to_numpy(),
+                expected.cells[level].to_numpy(),
+                rtol=1e-9,
+                atol=1e-3,
+            )
+            self.assertTrue(grown.histograms[level].equals(expected.histograms[level]))
+
+    def test_std_of_large_close_prices(self):
+        # The sums of squares of such prices cancel in floating point
+        sales = self.sales.assign(price=10**9 + np.arange(len(self.sales.index)) % 7)
+        cube = self.build(sales)
+        prices = sales.join(self.regions, on="postcode", how="inner").price
+        self.assertAlmostEqual(
+            cube.summary("AB", "area")["std"], prices.std(), delta=1e-6
+        )
+
+    def test_locate(self):
+        cube = self.build(self.sales.iloc[:10])
+        self.assertEqual(
+            cube.locate(51.5302, -0.0698),
+            {"area": "AB", "district": "AB3", "sector": "AB3 3"},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
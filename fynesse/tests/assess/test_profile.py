@@ -0,0 +1,66 @@
+import unittest
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from fynesse import access, assess
+from fynesse.tests import fixtures
+
+
+class TestProfile(fixtures.DatasetTestCase):
+    n = 500
+    connect = False
+
+    def test_counts_and_invalid_values(self):
+        bad = [list(row) for row in self.rows[2018][:10]]
+        for row in bad[:4]:
+            row[1] = "abc"
+        for row in bad[4:]:
+            row[4] = "X"
+        bad[0][3] = ""
+        bad[5][2] = "not a date"
+        bad[6][2] = "2019-13-45 00:00"
+        fixtures.write_sales("bad.csv", bad)
+        filenames = [f"pp-{year}.csv" for year in self.rows] + ["bad.csv"]
+
+        report = assess.profile(filenames=filenames, chunksize=100, processes=2)
+        total = sum(map(len, self.rows.values())) + len(bad)
+        self.assertEqual(report.loc["price", "count"], total)
+        self.assertEqual(report.loc["price", "invalid"], 4)
+        self.assertEqual(report.loc["property_type", "invalid"], 6)
+        self.assertEqual(report.loc["postcode", "nulls"], 1)
+        self.assertEqual(report.loc["date_of_transfer", "invalid"], 2)
+        prices = pd.DataFrame([row for rows in self.rows.values() for row in rows])[
+            1
+        ].astype(float)
+        self.assertEqual(report.loc["price", "min"], prices.min())
+        self.assertEqual(report.loc["price", "max"], prices.max())
+        self.assertEqual(report.loc["date_of_transfer", "min"].year, min(self.rows))
+
+    def test_database_decimals(self):
+        chunk = pd.DataFrame(
+            {"latitude": pd.Series([Decimal("51.5"), Decimal("52.25"), None, "x"])}
+        )
+        profile = assess._profile_chunk(chunk, 16)["latitude"]
+        self.assertEqual((profile["min"], profile["max"]), (51.5, 52.25))
+        self.assertEqual((profile["nulls"], profile["invalid"]), (1, 1))
+        self.assertEqual(profile["sketch"][0][0].dtype, np.float64)
+
+    def test_sketch_error_does_not_grow_with_chunks(self):
+        rng = np.random.default_rng(0)
+        values = rng.lognormal(12, 1, 200_000)
+        size = 256
+        sketch = None
+        for chunk in np.array_split(values, 400):
+            part = assess._quantile_sketch(chunk, size)
+            sketch = (
+                part if sketch is None else assess._merge_sketches(sketch, part, size)
+            )
+        for q in [0.01, 0.25, 0.5, 0.75, 0.99]:
+            rank = (values < assess._sketch_quantile(sketch, q)).mean()
+            self.assertLess(abs(rank - q), 2.5 / size)
+
+
+if __name__ == "__main__":
+    unittest.main()
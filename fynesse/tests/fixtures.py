@@ -0,0 +1,116 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fynesse import access
+
+"""Small synthetic Land Registry and postcode files, in the formats of pp-YEAR.csv and open_postcode_geo.csv"""
+
+# Postcodes on a 10 by 10 grid of 0.01 degrees, from (51.5, -0.1)
+POSTCODES = [
+    (f"AB{row} {column}CD", 51.5 + 0.01 * row, -0.1 + 0.01 * column)
+    for row in range(10)
+    for column in range(10)
+]
+
+
+def write_postcodes(filename: str, postcodes: list = None) -> None:
+    """Write (postcode, latitude, longitude) rows, a latitude of None leaving the postcode without coordinates"""
+    with open(filename, "w", newline="") as file:
+        writer = csv.writer(file)
+        for i, (postcode, latitude, longitude) in enumerate(postcodes or POSTCODES):
+            outcode, incode = postcode.split(" ")
+            writer.writerow(
+                [
+                    postcode,
+                    "live",
+                    "small",
+                    400000 + i,
+                    100000 + i,
+                    1,
+                    "England",
+                    "" if latitude is None else f"{latitude:.8f}",
+                    "" if longitude is None else f"{longitude:.8f}",
+                    postcode.replace(" ", ""),
+                    postcode,
+                    postcode,
+                    outcode[:2],
+                    outcode,
+                    f"{outcode} {incode[0]}",
+                    outcode,
+                    incode,
+                ]
+            )
+
+
+def sales(year: int, n: int, seed: int = 0, postcodes: list = None) -> list:
+    """n sales of year as rows of pp-YEAR.csv, at random postcodes, property types and dates"""
+    rng = np.random.default_rng(seed + year)
+    postcodes = [row[0] for row in (postcodes or POSTCODES)]
+    rows = []
+    for i in range(n):
+        month, day = rng.integers(1, 13), rng.integers(1, 29)
+        rows.append(
+            [
+                f"{{{year:04d}{seed:04d}-0000-0000-0000-{i:012d}}}",
+                str(int(rng.integers(50_000, 1_000_000))),
+                f"{year}-{month:02d}-{day:02d} 00:00",
+                postcodes[int(rng.integers(len(postcodes)))],
+                "DSTF"[int(rng.integers(4))],
+                "N",
+                "F",
+                str(i),
+                "",
+                "STREET",
+                "LOCALITY",
+                "TOWN",
+                "DISTRICT",
+                "COUNTY",
+                "A",
+                "A",
+            ]
+        )
+    return rows
+
+
+def write_sales(filename: str, rows: list) -> None:
+    with open(filename, "w", newline="") as file:
+        csv.writer(file, quoting=csv.QUOTE_ALL).writerows(rows)
+
+
+def write_dataset(directory: str, years=range(2018, 2021), n: int = 200) -> dict:
+    """Write pp-YEAR.csv for years and open_postcode_geo.csv to directory, returning the rows of each year"""
+    rows = {}
+    for year in years:
+        rows[year] = sales(year, n)
+        write_sales(os.path.join(directory, f"pp-{year}.csv"), rows[year])
+    write_postcodes(os.path.join(directory, "open_postcode_geo.csv"))
+    return rows
+
+
+class DatasetTestCase(unittest.TestCase):
+    """Runs each test in a temporary working directory holding the files of write_dataset,
+    with an embedded property_prices database unless connect is False"""
+
+    years = range(2018, 2021)
+    n = 200
+    connect = True
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        self.rows = write_dataset(self.directory.name, self.years, self.n)
+        self.conn = None
+        if self.connect:
+            self.conn = access.create_connection(backend="embedded")
+            access.create_database_property_prices(self.conn)
+
+    def tearDown(self):
+        if self.conn is not None:
+            self.conn.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
@@ -34,6 +34,7 @@ REQUIRED = [
     "jupyter",
     "matplotlib",
     "pymysql",
+    "pyarrow",
     "scikit-learn",
     "osmnx",
     "mlai",